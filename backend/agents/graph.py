@@ -24,13 +24,17 @@ def create_analysis_graph():
     workflow.add_node("generate_insights", generate_insights_node)
     workflow.add_node("generate_sql", generate_sql_node)
     
-    # Define the workflow edges (sequential execution)
+    # Define the workflow edges
+    # Statistics, anomalies and visualizations only depend on the cleaned data,
+    # so they fan out from clean_data and run concurrently (disjoint state keys),
+    # then fan back in at generate_insights. SQL generation doesn't use any of
+    # their results, so it runs alongside them and finishes independently.
     workflow.set_entry_point("clean_data")
-    workflow.add_edge("clean_data", "generate_statistics")
-    workflow.add_edge("generate_statistics", "detect_anomalies")
-    workflow.add_edge("detect_anomalies", "create_visualizations")
-    workflow.add_edge("create_visualizations", "generate_insights")
-    workflow.add_edge("generate_insights", "generate_sql")
+    for branch in ("generate_statistics", "detect_anomalies", "create_visualizations"):
+        workflow.add_edge("clean_data", branch)
+        workflow.add_edge(branch, "generate_insights")
+    workflow.add_edge("clean_data", "generate_sql")
+    workflow.add_edge("generate_insights", END)
     workflow.add_edge("generate_sql", END)
     
     # Compile the graph
@@ -0,0 +1,48 @@
+"""
+Shared LLM clients.
+All agents send requests through the same pooled HTTP clients, so concurrent
+calls reuse open (HTTP/2) connections instead of each paying TCP/TLS setup.
+"""
+
+import os
+import httpx
+from langchain_openai import ChatOpenAI
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))  # seconds
+
+_limits = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+
+http_async_client = httpx.AsyncClient(http2=True, limits=_limits, timeout=LLM_TIMEOUT)
+http_client = httpx.Client(http2=True, limits=_limits, timeout=LLM_TIMEOUT)
+
+
+def create_llm(temperature: float, **kwargs) -> ChatOpenAI:
+    """
+    Create a DeepSeek chat model that uses the shared connection pool.
+
+    Args:
+        temperature: Sampling temperature
+        **kwargs: Extra ChatOpenAI options
+
+    Returns:
+        Configured ChatOpenAI instance
+    """
+    return ChatOpenAI(
+        model="deepseek/deepseek-chat",
+        openai_api_key=os.getenv("DEEPSEEK_API_KEY"),
+        openai_api_base=os.getenv("DEEPSEEK_BASE_URL"),
+        temperature=temperature,
+        max_retries=2,  # Transient 5xx/429s are retried by the client
+        http_async_client=http_async_client,
+        http_client=http_client,
+        **kwargs
+    )
+
+
+async def close_http_clients() -> None:
+    """Close the shared connection pools (call on application shutdown)"""
+    await http_async_client.aclose()
+    http_client.close()
@@ -1,91 +1,305 @@
 import pandas as pd
 import numpy as np
+import orjson
+import pyarrow as pa
+import pyarrow.feather as feather
+from pyarrow import csv as pacsv
 from sklearn.ensemble import IsolationForest
-import matplotlib.pyplot as plt
+import matplotlib
+matplotlib.use('Agg')  # Headless rendering; no GUI backend lookups
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import seaborn as sns
 import os
-from datetime import datetime
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time
+from typing import Optional
 from agents.state import AgentState
-from langchain_openai import ChatOpenAI
+from agents.llm import create_llm
 from dotenv import load_dotenv
 
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional; fall back to vectorized pandas
+    njit = None
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Initialize LLM with DeepSeek
-llm = ChatOpenAI(
-    model="deepseek/deepseek-chat",
-    openai_api_key=os.getenv("DEEPSEEK_API_KEY"),
-    openai_api_base=os.getenv("DEEPSEEK_BASE_URL"),
-    temperature=0.7
-)
+llm = create_llm(temperature=0.7)
+
+# Row indices of duplicates kept in the cleaning report (the count is always exact)
+MAX_DUPLICATE_INDICES = 100
 
 VIZ_DIR = os.getenv("VISUALIZATIONS_DIR", "./visualizations")
 os.makedirs(VIZ_DIR, exist_ok=True)
 
+# pandas dtype -> PostgreSQL column type for generated CREATE TABLE statements
+# (anything not listed, e.g. object/category, becomes TEXT)
+SQL_TYPES = {
+    'int64': 'INTEGER',
+    'int32': 'INTEGER',
+    'int16': 'INTEGER',
+    'int8': 'INTEGER',
+    'float64': 'DECIMAL',
+    'float32': 'DECIMAL',
+    'bool': 'BOOLEAN',
+    'datetime64[ns]': 'TIMESTAMP',
+    'datetime64[us]': 'TIMESTAMP',
+    'datetime64[ms]': 'TIMESTAMP',
+    'datetime64[s]': 'TIMESTAMP',
+}
+
+# Charts are written as WebP (smaller than PNG at equal quality) at a screen-friendly dpi
+VIZ_FORMAT = "webp"
+VIZ_DPI = 80
+
+# Scatter plots are drawn from a random sample above this many points
+SCATTER_MAX_POINTS = 10000
+
+# Wider correlation heatmaps only annotate their strongest pairs
+HEATMAP_ANNOT_MAX_COLS = 40
+HEATMAP_ANNOT_TOP_K = 20
+
+# Chart style is global matplotlib state; set it once rather than per render thread
+sns.set_style("whitegrid")
+
+
+def to_jsonable(obj):
+    """Convert NumPy types (scalars, arrays, NaN) to native JSON-compatible Python types"""
+    return orjson.loads(orjson.dumps(
+        obj,
+        default=str,
+        option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    ))
+
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _iqr_and_negs(arr):
+        """Per-column Q1, Q3, IQR outlier count and negative count in one pass over arr (n, k)"""
+        n, k = arr.shape
+        q1 = np.full(k, np.nan)
+        q3 = np.full(k, np.nan)
+        outlier_counts = np.zeros(k, dtype=np.int64)
+        neg_counts = np.zeros(k, dtype=np.int64)
+        for j in prange(k):
+            col = arr[:, j]
+            vals = np.sort(col[~np.isnan(col)])
+            m = vals.shape[0]
+            if m == 0:
+                continue
+            # Linear interpolation, matching pandas' default quantile method
+            pos = (m - 1) * 0.25
+            i = int(pos)
+            q1[j] = vals[i] + (vals[min(i + 1, m - 1)] - vals[i]) * (pos - i)
+            pos = (m - 1) * 0.75
+            i = int(pos)
+            q3[j] = vals[i] + (vals[min(i + 1, m - 1)] - vals[i]) * (pos - i)
+
+            iqr = q3[j] - q1[j]
+            lo = q1[j] - 1.5 * iqr
+            hi = q3[j] + 1.5 * iqr
+            for r in range(n):
+                v = col[r]
+                if v < lo or v > hi:
+                    outlier_counts[j] += 1
+                if v < 0:
+                    neg_counts[j] += 1
+        return q1, q3, outlier_counts, neg_counts
+else:
+    _iqr_and_negs = None
+
+
+def numeric_scan(numeric_df: pd.DataFrame):
+    """
+    Scan numeric columns for IQR bounds, outlier counts and negative counts.
+
+    Returns:
+        Tuple of (Q1, Q3, outlier_counts, neg_counts) Series indexed by column
+    """
+    cols = numeric_df.columns
+    if _iqr_and_negs is not None:
+        # Column-major copy so each column is a contiguous run for the kernel
+        arr = np.asfortranarray(numeric_df.to_numpy(dtype=np.float64))
+        q1, q3, outlier_counts, neg_counts = _iqr_and_negs(arr)
+        return (pd.Series(q1, index=cols), pd.Series(q3, index=cols),
+                pd.Series(outlier_counts, index=cols), pd.Series(neg_counts, index=cols))
+
+    q = numeric_df.quantile([0.25, 0.75])
+    Q1, Q3 = q.iloc[0], q.iloc[1]
+    IQR = Q3 - Q1
+    outlier_counts = (numeric_df.lt(Q1 - 1.5 * IQR) | numeric_df.gt(Q3 + 1.5 * IQR)).sum()
+    return Q1, Q3, outlier_counts, numeric_df.lt(0).sum()
+
+
+def cleaned_arrow_path(file_path: str) -> str:
+    """Path of the Arrow (Feather) copy of the cleaned dataset for file_path"""
+    cleaned_filename = f"cleaned_{os.path.basename(file_path)}.arrow"
+    return os.path.join(os.path.dirname(file_path), cleaned_filename)
+
+
+def replace_atomically(path: str, write) -> None:
+    """
+    Call write(tmp_path) on a temporary file next to path, then rename it over path.
+    
+    Readers (including ones memory-mapping the old file) never see a partial file,
+    and concurrent writers simply leave the last complete version in place.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def arrow_table_from_pandas(df: pd.DataFrame) -> pa.Table:
+    """
+    Convert a DataFrame to Arrow, stringifying mixed-type object columns
+    (e.g. numbers and text in one Excel column) that Arrow can't type.
+    """
+    try:
+        return pa.Table.from_pandas(df)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        df = df.copy()
+        for col in df.select_dtypes(include='object').columns:
+            df[col] = df[col].astype(str).where(df[col].notna(), None)
+        return pa.Table.from_pandas(df)
+
 
-def convert_numpy(obj):
-    """Recursively convert NumPy types to native Python types"""
-    if isinstance(obj, (np.int_, np.intc, np.intp, np.int8,
-                        np.int16, np.int32, np.int64, np.uint8,
-                        np.uint16, np.uint32, np.uint64)):
-        return int(obj)
-    elif isinstance(obj, (np.float_, np.float16, np.float32, np.float64)):
-        return float(obj)
-    elif isinstance(obj, (np.ndarray,)):
-        return obj.tolist()
-    elif isinstance(obj, dict):
-        return {k: convert_numpy(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_numpy(i) for i in obj]
-    elif isinstance(obj, tuple):
-        return tuple(convert_numpy(i) for i in obj)
-    return obj
-
-
-def clean_data_node(state: AgentState) -> AgentState:
+def _csv_convert_options(arrow_schema: Optional[pa.Schema] = None) -> pacsv.ConvertOptions:
+    """
+    CSV conversion options matching pd.read_csv's typing.
+    
+    strings_can_be_null treats empty/"NA" strings as missing, like pandas. Arrow
+    also infers dates, times and timestamps, which pandas keeps as text; given
+    the schema of a first read, those columns are forced back to strings.
+    """
+    temporal = [field.name for field in arrow_schema or [] if pa.types.is_temporal(field.type)]
+    return pacsv.ConvertOptions(
+        strings_can_be_null=True,
+        column_types={name: pa.string() for name in temporal}
+    )
+
+
+def _has_temporal_columns(arrow_schema: pa.Schema) -> bool:
+    return any(pa.types.is_temporal(field.type) for field in arrow_schema)
+
+
+def read_csv_table(file_path: str) -> pa.Table:
+    """Read a whole CSV with the multi-threaded Arrow parser, typed like pd.read_csv"""
+    read_options = pacsv.ReadOptions(use_threads=True)
+    table = pacsv.read_csv(file_path, read_options=read_options, convert_options=_csv_convert_options())
+    if _has_temporal_columns(table.schema):
+        # Re-read with those columns as text (inferred types aren't known up front)
+        table = pacsv.read_csv(
+            file_path, read_options=read_options, convert_options=_csv_convert_options(table.schema)
+        )
+    return table
+
+
+def read_dataset(file_path: str) -> pd.DataFrame:
+    """Read an uploaded CSV/Excel file into a DataFrame"""
+    if file_path.endswith('.csv'):
+        # Numeric columns are handed over to pandas without copies
+        return read_csv_table(file_path).to_pandas(split_blocks=True, self_destruct=True)
+    # calamine (Rust) parses workbooks much faster than openpyxl
+    return pd.read_excel(file_path, engine="calamine")
+
+
+def _open_csv(file_path: str) -> pacsv.CSVStreamingReader:
+    """Streaming CSV reader typed like pd.read_csv (types inferred from the first block)"""
+    reader = pacsv.open_csv(file_path, convert_options=_csv_convert_options())
+    if _has_temporal_columns(reader.schema):
+        reader = pacsv.open_csv(file_path, convert_options=_csv_convert_options(reader.schema))
+    return reader
+
+
+def read_csv_schema(file_path: str) -> pa.Schema:
+    """Column types of a CSV as inferred from its first block"""
+    return _open_csv(file_path).schema
+
+
+def read_csv_head(file_path: str, nrows: int) -> pa.Table:
+    """Read only the first nrows rows of a CSV, one Arrow block at a time"""
+    reader = _open_csv(file_path)
+    batches, rows = [], 0
+    for batch in reader:
+        batches.append(batch)
+        rows += batch.num_rows
+        if rows >= nrows:
+            break
+    return pa.Table.from_batches(batches, schema=reader.schema).slice(0, nrows)
+
+
+def load_df(state: AgentState) -> pd.DataFrame:
+    """Memory-map the cleaned Arrow file referenced by state["cleaned_data"]"""
+    table = feather.read_table(state["cleaned_data"], memory_map=True)
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def clean_data_node(state: AgentState) -> dict:
     """Clean the uploaded dataset"""
     try:
         # Load data
         file_path = state["file_path"]
-        if file_path.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        else:  # Excel
-            df = pd.read_excel(file_path)
-        
-        state["raw_data"] = df
+        df = read_dataset(file_path)
+        raw_shape = df.shape
         
         # 1. Remove completely empty rows or rows with all NaNs
         df = df.dropna(how='all')
         
-        # 2. Fix malformed strings (trim whitespace)
-        df = df.applymap(lambda x: x.strip() if isinstance(x, str) else x)
-        
+        # 2. Fix malformed strings (trim whitespace) and
         # 3. Convert invalid numbers to NaN (coerce errors)
-        # Iterate over columns that should be numeric but might have mixed types
-        for col in df.columns:
-            # Check if column has mixed types (object) but looks numeric
-            if df[col].dtype == 'object':
-                # Try to convert to numeric, coercing errors to NaN
-                # This handles "invalid numbers" by turning them into NaN
-                # We only do this if it doesn't result in losing too much data (heuristic)
-                # For now, let's apply it to columns that are predominantly numeric
-                try:
-                    numeric_series = pd.to_numeric(df[col], errors='coerce')
-                    # If we successfully converted some values and didn't lose everything
-                    if numeric_series.notna().sum() > 0:
-                        df[col] = numeric_series
-                except:
-                    pass
-
+        # Only object columns can hold strings or mixed types, so both steps
+        # share a single pass over them using pandas' vectorized string ops
+        obj_cols = df.select_dtypes(include='object').columns
+        for col in obj_cols:
+            # .str.strip() leaves non-string cells (numbers, NaN) as NaN, so
+            # only overwrite the cells that actually held strings
+            try:
+                stripped = df[col].str.strip()
+                df[col] = stripped.where(stripped.notna(), df[col])
+            except AttributeError:
+                # Object column without any string values (e.g. only bools)
+                pass
+
+            # Try to convert to numeric, coercing errors to NaN
+            # This handles "invalid numbers" by turning them into NaN
+            # We only do this if it doesn't result in losing too much data (heuristic)
+            # For now, let's apply it to columns that are predominantly numeric
+            try:
+                numeric_series = pd.to_numeric(df[col], errors='coerce')
+                # If we successfully converted some values and didn't lose everything
+                if numeric_series.notna().sum() > 0:
+                    df[col] = numeric_series
+            except:
+                pass
+
+        # Duplicates are hashed here once; anomaly detection reuses duplicate_indices
+        dup_mask = df.duplicated()
+        dup_all_mask = df.duplicated(keep=False)
+        
         cleaning_report = {
             "original_shape": df.shape,
             "missing_values": df.isnull().sum().to_dict(),
-            "duplicates": int(df.duplicated().sum()),
+            "duplicates": int(dup_mask.sum()),
+            # Rows involved in duplication; only a sample of their indices is persisted
+            "duplicate_rows": int(dup_all_mask.sum()),
+            "duplicate_indices": df.index[dup_all_mask][:MAX_DUPLICATE_INDICES].tolist(),
             "data_types": df.dtypes.astype(str).to_dict()
         }
         
         # 4. Remove duplicates
-        df_cleaned = df.drop_duplicates()
+        # Explicit copy: the filled/downcast columns below are assigned in place
+        df_cleaned = df.loc[~dup_mask].copy()
         
         # 5. Handle missing values - BUT keep "realistic edge cases" and "statistical outliers"
         # The user said "convert invalid numbers to NaN" and "keep all valid rows"
@@ -95,14 +309,30 @@ def clean_data_node(state: AgentState) -> AgentState:
         # Let's stick to the previous logic of filling NaNs, as that makes the data "clean".
         # Outliers are naturally kept unless we explicitly drop them (which we are NOT doing).
         
-        for col in df_cleaned.columns:
-            if df_cleaned[col].dtype in ['float64', 'int64']:
-                # Fill numeric columns with median
-                df_cleaned[col] = df_cleaned[col].fillna(df_cleaned[col].median())
-            else:
-                # Fill categorical columns with mode
-                mode_val = df_cleaned[col].mode()[0] if not df_cleaned[col].mode().empty else 'Unknown'
-                df_cleaned[col] = df_cleaned[col].fillna(mode_val)
+        num_cols = df_cleaned.select_dtypes(include=[np.number]).columns
+        cat_cols = df_cleaned.columns.difference(num_cols, sort=False)
+
+        # Fill numeric columns with median (one vectorized pass over the block)
+        if len(num_cols) > 0:
+            df_cleaned[num_cols] = df_cleaned[num_cols].fillna(df_cleaned[num_cols].median())
+
+        # Fill categorical columns with mode ('Unknown' when a column has no values)
+        if len(cat_cols) > 0:
+            mode_vals = df_cleaned[cat_cols].mode(dropna=True).reindex([0]).iloc[0].fillna('Unknown')
+            df_cleaned[cat_cols] = df_cleaned[cat_cols].fillna(mode_vals)
+
+        # 6. Shrink dtypes so downstream statistics/anomaly passes move fewer bytes
+        # (original types are already recorded in cleaning_report["data_types"]).
+        # Integers only: float32 would leak rounding into the statistics and prompts
+        for col in num_cols:
+            if pd.api.types.is_integer_dtype(df_cleaned[col]):
+                df_cleaned[col] = pd.to_numeric(df_cleaned[col], downcast='integer')
+        if len(df_cleaned) > 0:
+            for col in df_cleaned.select_dtypes(include='object').columns:
+                # Low-cardinality strings become category (dictionary-encoded)
+                if df_cleaned[col].nunique() / len(df_cleaned) < 0.5:
+                    df_cleaned[col] = df_cleaned[col].astype('category')
+        cleaning_report["optimized_data_types"] = df_cleaned.dtypes.astype(str).to_dict()
         
         cleaning_report["cleaned_shape"] = df_cleaned.shape
         cleaning_report["rows_removed"] = df.shape[0] - df_cleaned.shape[0]
@@ -110,66 +340,84 @@ def clean_data_node(state: AgentState) -> AgentState:
         # Save cleaned data to file
         cleaned_filename = f"cleaned_{os.path.basename(file_path)}"
         cleaned_file_path = os.path.join(os.path.dirname(file_path), cleaned_filename)
-        df_cleaned.to_csv(cleaned_file_path, index=False)
+        # Analyses of the same dataset can overlap, so files are swapped in whole
+        replace_atomically(cleaned_file_path, lambda tmp: df_cleaned.to_csv(tmp, index=False))
+        # Uncompressed Arrow copy so readers can memory-map it without re-parsing;
+        # downstream nodes receive this path instead of the DataFrame itself
+        arrow_path = cleaned_arrow_path(file_path)
+        table = arrow_table_from_pandas(df_cleaned)
+        replace_atomically(arrow_path, lambda tmp: feather.write_feather(table, tmp, compression='uncompressed'))
         cleaning_report["cleaned_file_path"] = cleaned_filename
 
-        state["cleaned_data"] = df_cleaned
-        state["cleaning_report"] = convert_numpy(cleaning_report)
-        state["status"] = "cleaning_completed"
-        
-        return state
+        return {
+            "raw_shape": raw_shape,
+            "cleaned_data": arrow_path,
+            "cleaning_report": to_jsonable(cleaning_report),
+            "status": "cleaning_completed"
+        }
     
     except Exception as e:
-        state["errors"] = state.get("errors", []) + [f"Data cleaning error: {str(e)}"]
-        state["status"] = "failed"
-        return state
+        return {"errors": [f"Data cleaning error: {str(e)}"], "status": "failed"}
 
 
-def generate_statistics_node(state: AgentState) -> AgentState:
+def statistics_to_json(statistics: Optional[dict]) -> Optional[dict]:
+    """Materialize Arrow-backed statistics into the JSON form stored and served by the API"""
+    if not statistics:
+        return statistics
+    result = {key: value for key, value in statistics.items() if not key.endswith('_arrow')}
+    for key in ("numeric_summary", "correlations"):
+        table = statistics.get(f"{key}_arrow")
+        result[key] = table.to_pandas().to_dict() if table is not None else {}
+    return to_jsonable(result)
+
+
+def generate_statistics_node(state: AgentState) -> dict:
     """Generate summary statistics"""
     try:
-        df = state["cleaned_data"]
+        df = load_df(state)
         
         statistics = {
-            "shape": df.shape,
-            "columns": list(df.columns),
-            "numeric_summary": {},
+            "shape": [int(n) for n in df.shape],
+            "columns": [str(col) for col in df.columns],
+            # describe()/corr() results stay columnar (Arrow) inside the workflow;
+            # statistics_to_json() builds the dict form at the API/database boundary
+            "numeric_summary_arrow": None,
             "categorical_summary": {},
-            "correlations": {}
+            "correlations_arrow": None
         }
         
         # Numeric columns statistics
         numeric_cols = df.select_dtypes(include=[np.number]).columns
         if len(numeric_cols) > 0:
-            statistics["numeric_summary"] = df[numeric_cols].describe().to_dict()
+            statistics["numeric_summary_arrow"] = pa.Table.from_pandas(df[numeric_cols].describe(), preserve_index=True)
             
             # Correlation matrix
             if len(numeric_cols) > 1:
                 corr_matrix = df[numeric_cols].corr()
-                statistics["correlations"] = corr_matrix.to_dict()
+                statistics["correlations_arrow"] = pa.Table.from_pandas(corr_matrix, preserve_index=True)
         
         # Categorical columns statistics
-        categorical_cols = df.select_dtypes(include=['object']).columns
+        categorical_summary = {}
+        categorical_cols = df.select_dtypes(include=['object', 'category']).columns
         for col in categorical_cols:
-            statistics["categorical_summary"][col] = {
+            categorical_summary[col] = {
                 "unique_values": int(df[col].nunique()),
                 "top_values": df[col].value_counts().head(5).to_dict()
             }
+        statistics["categorical_summary"] = to_jsonable(categorical_summary)
         
-        state["statistics"] = convert_numpy(statistics)
-        state["status"] = "statistics_completed"
-        
-        return state
+        # Runs in parallel with the other analysis branches, so only write
+        # this node's own key (no shared "status")
+        return {"statistics": statistics}
     
     except Exception as e:
-        state["errors"] = state.get("errors", []) + [f"Statistics generation error: {str(e)}"]
-        return state
+        return {"errors": [f"Statistics generation error: {str(e)}"]}
 
 
-def detect_anomalies_node(state: AgentState) -> AgentState:
+def detect_anomalies_node(state: AgentState) -> dict:
     """Advanced anomaly + data quality detection"""
     try:
-        df = state["cleaned_data"].copy()
+        df = load_df(state)
         anomalies = {
             "outliers": {},
             "invalid_values": {},
@@ -189,183 +437,243 @@ def detect_anomalies_node(state: AgentState) -> AgentState:
         anomalies["missing_values"] = missing[missing > 0].to_dict()
 
         
-        # 2 Duplicate Rows 
-        dup_mask = df.duplicated(keep=False)
-        anomalies["duplicates"] = dup_mask.sum()
-        anomalies["rows_with_duplicates"] = df[dup_mask].index.tolist()
+        # 2 Duplicate Rows (found before de-duplication, see clean_data_node)
+        duplicate_indices = state["cleaning_report"].get("duplicate_indices", [])
+        anomalies["duplicates"] = state["cleaning_report"].get("duplicate_rows", len(duplicate_indices))
+        anomalies["rows_with_duplicates"] = duplicate_indices  # First MAX_DUPLICATE_INDICES only
 
        
        
          #Invalid Data Types (e.g. salary="abc")
-        for col in df.columns:
-            invalid_mask = df[col].apply(
-                lambda x: isinstance(x, str) and x.strip().lower() in ["nan", "null", "", "none"]
-            )
-            if invalid_mask.sum() > 0:
-                anomalies["invalid_values"][col] = df[col][invalid_mask].tolist()
+        # Only object/category columns can hold strings; use vectorized .str ops
+        invalid_tokens = {"nan", "null", "", "none"}
+        for col in df.select_dtypes(include=['object', 'category']).columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                # Check the (few) categories instead of every row
+                cats = df[col].cat.categories
+                bad = [c for c in cats if isinstance(c, str) and c.strip().lower() in invalid_tokens]
+                invalid_mask = df[col].isin(bad)
+            else:
+                try:
+                    invalid_mask = df[col].str.strip().str.lower().isin(invalid_tokens)
+                except AttributeError:
+                    # No string values in this column
+                    continue
+            if invalid_mask.any():
+                anomalies["invalid_values"][col] = df.loc[invalid_mask, col].tolist()
 
 
 
 #Statistical Outliers (IQR)
-        for col in numeric_cols:
-            Q1 = df[col].quantile(0.25)
-            Q3 = df[col].quantile(0.75)
+        neg_counts = pd.Series(dtype='int64')
+        if len(numeric_cols) > 0:
+            # Quantiles, outlier and negative counts for all numeric columns at once
+            numeric_df = df[numeric_cols]
+            Q1, Q3, counts, neg_counts = numeric_scan(numeric_df)
             IQR = Q3 - Q1
 
-            outliers = df[(df[col] < Q1 - 1.5 * IQR) | (df[col] > Q3 + 1.5 * IQR)]
-            if len(outliers) > 0:
+            for col in counts.index[counts > 0]:
+                count = int(counts[col])
+                col_mask = numeric_df[col].lt(Q1[col] - 1.5 * IQR[col]) | numeric_df[col].gt(Q3[col] + 1.5 * IQR[col])
                 anomalies["outliers"][col] = {
-                    "count": len(outliers),
-                    "percentage": round(len(outliers) / len(df) * 100, 2),
-                    "values": outliers[col].tolist()[:10]
+                    "count": count,
+                    "percentage": round(count / len(df) * 100, 2),
+                    "values": df.loc[col_mask, col].tolist()[:10]
                 }
 
        
         #Domain Rules
         domain_issues = {}
 
+        # Each rule is a NumPy boolean mask over columns read once as arrays
+        index = df.index.to_numpy()
+        age = df["age"].to_numpy() if "age" in df.columns else None
+
         # Age limits
-        domain_issues["invalid_age"] = df[(df["age"] < 18) | (df["age"] > 70)].index.tolist() if "age" in df else []
+        domain_issues["invalid_age"] = index[(age < 18) | (age > 70)].tolist() if age is not None else []
 
         # Experience > Age (impossible)
-        if "age" in df.columns and "years_experience" in df.columns:
-            domain_issues["exp_gt_age"] = df[df["years_experience"] > df["age"]].index.tolist()
+        if age is not None and "years_experience" in df.columns:
+            domain_issues["exp_gt_age"] = index[df["years_experience"].to_numpy() > age].tolist()
 
         # Future promotion year
         if "last_promotion_year" in df.columns:
-            domain_issues["future_year"] = df[df["last_promotion_year"] > pd.Timestamp.now().year].index.tolist()
+            domain_issues["future_year"] = index[df["last_promotion_year"].to_numpy() > pd.Timestamp.now().year].tolist()
 
-        # Negative values
-        for col in numeric_cols:
-            neg = df[df[col] < 0]
-            if len(neg) > 0:
-                domain_issues[f"negative_{col}"] = neg.index.tolist()
+        # Negative values: one 2D mask over just the columns the numeric scan
+        # found negatives in, then per-column row positions from it
+        neg_cols = neg_counts.index[neg_counts > 0]
+        if len(neg_cols) > 0:
+            neg_mask_2d = df[neg_cols].to_numpy() < 0
+            for j, col in enumerate(neg_cols):
+                domain_issues[f"negative_{col}"] = index[neg_mask_2d[:, j]].tolist()
 
         anomalies["domain_anomalies"] = domain_issues
 
         
         #Multivariate Outliers (Isolation Forest)
         if len(numeric_cols) >= 2:
-            iso_forest = IsolationForest(contamination=0.1, random_state=42)
-            preds = iso_forest.fit_predict(df[numeric_cols].fillna(0))
+            # sklearn trees work in float32; converting up front avoids a second copy.
+            # copy=True because the frame may be backed by read-only mapped memory
+            X = df[numeric_cols].to_numpy(dtype=np.float32, copy=True)
+            np.nan_to_num(X, copy=False, nan=0.0)
+            iso_forest = IsolationForest(
+                n_estimators=100,
+                max_samples=min(256, len(df)),
+                contamination=0.1,
+                n_jobs=-1,
+                random_state=42
+            )
+            preds = iso_forest.fit_predict(X)
             anomaly_mask = preds == -1
             anomalies["anomaly_indices"] = df[anomaly_mask].index.tolist()
 
         # Summary
         anomalies["summary"] = "Advanced anomaly detection completed."
 
-        state["anomalies"] = convert_numpy(anomalies)
-        state["status"] = "anomaly_detection_completed"
-        return state
+        return {"anomalies": to_jsonable(anomalies)}
 
     except Exception as e:
-        state["errors"] = state.get("errors", []) + [f"Anomaly detection error: {str(e)}"]
-        return state
+        return {"errors": [f"Anomaly detection error: {str(e)}"]}
+
+
+
+def _new_figure(figsize):
+    """Create a standalone Agg figure (no shared pyplot state, safe across threads)"""
+    fig = Figure(figsize=figsize, facecolor='white')
+    FigureCanvasAgg(fig)
+    return fig, fig.add_subplot()
 
 
+def _save_figure(fig, filename):
+    filepath = os.path.join(VIZ_DIR, filename)
+    fig.savefig(filepath, format=VIZ_FORMAT, dpi=VIZ_DPI, bbox_inches='tight')
 
-def create_visualizations_node(state: AgentState) -> AgentState:
+
+def _histogram_chart(df, col, dataset_id):
+    fig, ax = _new_figure((10, 6))
+    ax.hist(df[col].dropna().to_numpy(), bins=30, edgecolor='black', alpha=0.7)
+    ax.set_title(f'Distribution of {col}')
+    ax.set_xlabel(col)
+    ax.set_ylabel('Frequency')
+    
+    filename = f"hist_{dataset_id}_{col}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{VIZ_FORMAT}"
+    _save_figure(fig, filename)
+    return {
+        "type": "histogram",
+        "column": col,
+        "filename": filename
+    }
+
+
+def _top_pairs_annotations(corr: np.ndarray, top_k: int) -> np.ndarray:
+    """Annotation grid labelling only the top_k strongest off-diagonal correlations"""
+    rows, cols = np.triu_indices(corr.shape[0], k=1)
+    strength = np.nan_to_num(np.abs(corr[rows, cols]))
+    top = np.argsort(strength)[-top_k:]
+    
+    annot = np.full(corr.shape, '', dtype=object)
+    for r, c in zip(rows[top], cols[top]):
+        annot[r, c] = annot[c, r] = f"{corr[r, c]:.2f}"
+    return annot
+
+
+def _correlation_chart(df, numeric_cols, dataset_id):
+    fig, ax = _new_figure((12, 10))
+    corr_matrix = df[numeric_cols].corr()
+    if len(numeric_cols) <= HEATMAP_ANNOT_MAX_COLS:
+        sns.heatmap(corr_matrix, annot=True, fmt='.2f', cmap='coolwarm', center=0, ax=ax)
+    else:
+        # Every annotation is a text artist, O(k^2) of them; label only the top pairs
+        sns.heatmap(corr_matrix, annot=_top_pairs_annotations(corr_matrix.to_numpy(), HEATMAP_ANNOT_TOP_K),
+                    fmt='', cmap='coolwarm', center=0, ax=ax)
+    ax.set_title('Correlation Heatmap')
+    
+    filename = f"corr_{dataset_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{VIZ_FORMAT}"
+    _save_figure(fig, filename)
+    return {
+        "type": "correlation",
+        "filename": filename
+    }
+
+
+def _bar_chart(df, col, dataset_id):
+    fig, ax = _new_figure((12, 6))
+    df[col].value_counts().head(10).plot(kind='bar', ax=ax)
+    ax.set_title(f'Top 10 Values in {col}')
+    ax.set_xlabel(col)
+    ax.set_ylabel('Count')
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_horizontalalignment('right')
+    
+    filename = f"bar_{dataset_id}_{col}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{VIZ_FORMAT}"
+    _save_figure(fig, filename)
+    return {
+        "type": "bar_chart",
+        "column": col,
+        "filename": filename
+    }
+
+
+def _scatter_chart(df, x_col, y_col, dataset_id):
+    # Rasterizing more points than this adds time but no visible detail
+    points = df[[x_col, y_col]]
+    if len(points) > SCATTER_MAX_POINTS:
+        points = points.sample(n=SCATTER_MAX_POINTS, random_state=0)
+    
+    fig, ax = _new_figure((10, 6))
+    ax.scatter(points[x_col].to_numpy(), points[y_col].to_numpy(), alpha=0.5)
+    ax.set_xlabel(x_col)
+    ax.set_ylabel(y_col)
+    ax.set_title(f'{x_col} vs {y_col}')
+    
+    filename = f"scatter_{dataset_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{VIZ_FORMAT}"
+    _save_figure(fig, filename)
+    return {
+        "type": "scatter",
+        "columns": [x_col, y_col],
+        "filename": filename
+    }
+
+
+def create_visualizations_node(state: AgentState) -> dict:
     """Create visualizations"""
     try:
-        df = state["cleaned_data"]
+        df = load_df(state)
         dataset_id = state["dataset_id"]
-        visualizations = []
         
         numeric_cols = df.select_dtypes(include=[np.number]).columns
-        categorical_cols = df.select_dtypes(include=['object']).columns
-        
-        # Set style
-        sns.set_style("whitegrid")
-        plt.rcParams['figure.facecolor'] = 'white'
-        
-        # 1. Numeric distributions (histograms)
-        if len(numeric_cols) > 0:
-            for col in numeric_cols[:3]:  # Limit to first 3 numeric columns
-                plt.figure(figsize=(10, 6))
-                plt.hist(df[col].dropna(), bins=30, edgecolor='black', alpha=0.7)
-                plt.title(f'Distribution of {col}')
-                plt.xlabel(col)
-                plt.ylabel('Frequency')
-                
-                filename = f"hist_{dataset_id}_{col}_{datetime.now().strftime('%Y%m%d%H%M%S')}.png"
-                filepath = os.path.join(VIZ_DIR, filename)
-                plt.savefig(filepath, dpi=100, bbox_inches='tight')
-                plt.close()
-                
-                visualizations.append({
-                    "type": "histogram",
-                    "column": col,
-                    "filename": filename
-                })
+        categorical_cols = df.select_dtypes(include=['object', 'category']).columns
         
-        # 2. Correlation heatmap
-        if len(numeric_cols) > 1:
-            plt.figure(figsize=(12, 10))
-            corr_matrix = df[numeric_cols].corr()
-            sns.heatmap(corr_matrix, annot=True, fmt='.2f', cmap='coolwarm', center=0)
-            plt.title('Correlation Heatmap')
+        # Charts are independent and mostly spend their time in Agg rendering,
+        # image (WebP) encoding and disk writes, so render them concurrently
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            # 1. Numeric distributions (histograms), first 3 numeric columns
+            futures = [executor.submit(_histogram_chart, df, col, dataset_id) for col in numeric_cols[:3]]
             
-            filename = f"corr_{dataset_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.png"
-            filepath = os.path.join(VIZ_DIR, filename)
-            plt.savefig(filepath, dpi=100, bbox_inches='tight')
-            plt.close()
-            
-            visualizations.append({
-                "type": "correlation",
-                "filename": filename
-            })
-        
-        # 3. Categorical value counts
-        if len(categorical_cols) > 0:
-            col = categorical_cols[0]
-            plt.figure(figsize=(12, 6))
-            df[col].value_counts().head(10).plot(kind='bar')
-            plt.title(f'Top 10 Values in {col}')
-            plt.xlabel(col)
-            plt.ylabel('Count')
-            plt.xticks(rotation=45, ha='right')
-            
-            filename = f"bar_{dataset_id}_{col}_{datetime.now().strftime('%Y%m%d%H%M%S')}.png"
-            filepath = os.path.join(VIZ_DIR, filename)
-            plt.savefig(filepath, dpi=100, bbox_inches='tight')
-            plt.close()
+            # 2. Correlation heatmap
+            if len(numeric_cols) > 1:
+                futures.append(executor.submit(_correlation_chart, df, numeric_cols, dataset_id))
             
-            visualizations.append({
-                "type": "bar_chart",
-                "column": col,
-                "filename": filename
-            })
-        
-        # 4. Scatter plot (if we have at least 2 numeric columns)
-        if len(numeric_cols) >= 2:
-            plt.figure(figsize=(10, 6))
-            plt.scatter(df[numeric_cols[0]], df[numeric_cols[1]], alpha=0.5)
-            plt.xlabel(numeric_cols[0])
-            plt.ylabel(numeric_cols[1])
-            plt.title(f'{numeric_cols[0]} vs {numeric_cols[1]}')
+            # 3. Categorical value counts
+            if len(categorical_cols) > 0:
+                futures.append(executor.submit(_bar_chart, df, categorical_cols[0], dataset_id))
             
-            filename = f"scatter_{dataset_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.png"
-            filepath = os.path.join(VIZ_DIR, filename)
-            plt.savefig(filepath, dpi=100, bbox_inches='tight')
-            plt.close()
+            # 4. Scatter plot (if we have at least 2 numeric columns)
+            if len(numeric_cols) >= 2:
+                futures.append(executor.submit(_scatter_chart, df, numeric_cols[0], numeric_cols[1], dataset_id))
             
-            visualizations.append({
-                "type": "scatter",
-                "columns": [numeric_cols[0], numeric_cols[1]],
-                "filename": filename
-            })
+            visualizations = [future.result() for future in futures]
         
-        state["visualizations"] = state.get("visualizations", []) + visualizations
-        state["status"] = "visualizations_completed"
-        
-        return state
+        # visualizations uses an operator.add reducer, so return only the new items
+        return {"visualizations": visualizations}
     
     except Exception as e:
-        state["errors"] = state.get("errors", []) + [f"Visualization error: {str(e)}"]
-        return state
+        return {"errors": [f"Visualization error: {str(e)}"]}
 
 
-def generate_insights_node(state: AgentState) -> AgentState:
+async def generate_insights_node(state: AgentState) -> dict:
     """Generate insights using LLM"""
     try:
         stats = state["statistics"]
@@ -388,7 +696,7 @@ Dataset Analysis Summary:
 - Columns: {', '.join(stats['columns'])}
 
 3. Numeric Summary:
-{stats.get('numeric_summary', 'No numeric columns')}
+{_summary_text(stats.get('numeric_summary_arrow'), 'No numeric columns')}
 
 4. Categorical Summary:
 {stats.get('categorical_summary', 'No categorical columns')}
@@ -407,28 +715,37 @@ Based on this analysis, provide:
 Keep the response concise but informative.
 """
         
-        response = llm.invoke(context)
+        response = await llm.ainvoke(context)
         insights = response.content
         
-        state["insights"] = insights
-        state["status"] = "insights_completed"
-        
-        return state
+        return {"insights": insights, "status": "completed"}
     
     except Exception as e:
         error_msg = str(e)
-        print(f"DEBUG: Caught exception in generate_insights_node: {error_msg}")
+        logger.exception("Insights generation failed")
         
         # Check for various forms of 402/Insufficient Balance or 404/Not Found
         if "402" in error_msg or "Insufficient Balance" in error_msg or "insufficient_quota" in error_msg or "404" in error_msg or "Not Found" in error_msg:
             # Fallback to mock insights
-            print("API Error: Insufficient Balance or Not Found. Falling back to mock insights.")
-            state["insights"] = generate_mock_insights(state["statistics"], state["anomalies"])
-            state["status"] = "insights_completed"
-            return state
+            logger.warning("LLM API unavailable, falling back to mock insights")
+            return {
+                "insights": generate_mock_insights(state["statistics"], state["anomalies"]),
+                "status": "completed"
+            }
             
-        state["errors"] = state.get("errors", []) + [f"Insights generation error: {error_msg}"]
-        return state
+        return {"errors": [f"Insights generation error: {error_msg}"]}
+
+
+def _summary_text(table, default: str) -> str:
+    """Render an Arrow statistics table as a text grid for the LLM prompt"""
+    return table.to_pandas().to_string() if table is not None else default
+
+
+def _arrow_column_count(table) -> int:
+    """Number of dataset columns in an Arrow statistics table (excluding its index)"""
+    if table is None:
+        return 0
+    return table.num_columns - len(table.schema.pandas_metadata.get('index_columns', []))
 
 
 def generate_mock_insights(stats: dict, anomalies: dict) -> str:
@@ -438,7 +755,7 @@ def generate_mock_insights(stats: dict, anomalies: dict) -> str:
         "",
         "**1. Key Insights**",
         f"- The dataset contains {stats['shape'][0]} rows and {stats['shape'][1]} columns.",
-        f"- There are {len(stats.get('numeric_summary', {}))} numeric variables and {len(stats.get('categorical_summary', {}))} categorical variables.",
+        f"- There are {_arrow_column_count(stats.get('numeric_summary_arrow'))} numeric variables and {len(stats.get('categorical_summary', {}))} categorical variables.",
         "",
         "**2. Patterns & Trends**",
         "- Distribution analysis shows varying ranges across numeric features.",
@@ -459,65 +776,58 @@ def generate_mock_insights(stats: dict, anomalies: dict) -> str:
     return "\n".join(insights)
 
 
-def generate_sql_node(state: AgentState) -> AgentState:
+def _sql_literal(val) -> str:
+    """Render a Python/NumPy value as a PostgreSQL literal"""
+    if pd.isna(val):
+        return 'NULL'
+    if isinstance(val, (date, time)):
+        # datetime/pd.Timestamp are date subclasses; unquoted they aren't valid SQL
+        val = val.isoformat(sep=' ') if isinstance(val, datetime) else val.isoformat()
+    if isinstance(val, str):
+        escaped_val = val.replace("'", "''")
+        return f"'{escaped_val}'"
+    return str(val)
+
+
+def generate_sql_node(state: AgentState) -> dict:
     """Generate SQL queries to load data into PostgreSQL"""
     try:
-        df = state["cleaned_data"]
+        df = load_df(state)
         filename = state["filename"]
         
         # Generate table name from filename
         table_name = filename.replace('.csv', '').replace('.xlsx', '').replace(' ', '_').lower()
         
         # Create table schema
-        sql_parts = [f"-- SQL Schema and Data for {filename}\n"]
-        sql_parts.append(f"CREATE TABLE IF NOT EXISTS {table_name} (")
-        sql_parts.append("    id SERIAL PRIMARY KEY,")
-        
-        # Add columns
-        for col in df.columns:
-            col_name = col.replace(' ', '_').lower()
-            dtype = df[col].dtype
-            
-            if dtype in ['int64', 'int32']:
-                sql_type = 'INTEGER'
-            elif dtype in ['float64', 'float32']:
-                sql_type = 'DECIMAL'
-            elif dtype == 'bool':
-                sql_type = 'BOOLEAN'
-            elif dtype == 'datetime64[ns]':
-                sql_type = 'TIMESTAMP'
-            else:
-                sql_type = 'TEXT'
-            
-            sql_parts.append(f"    {col_name} {sql_type},")
-        
-        # Remove last comma and close
-        sql_parts[-1] = sql_parts[-1].rstrip(',')
-        sql_parts.append(");\n")
-        
-        # Add sample INSERT statements (first 5 rows)
-        sql_parts.append(f"\n-- Sample INSERT statements (first 5 rows)")
-        for idx, row in df.head(5).iterrows():
-            values = []
-            for val in row:
-                if pd.isna(val):
-                    values.append('NULL')
-                elif isinstance(val, str):
-                    escaped_val = val.replace("'", "''")
-                    values.append(f"'{escaped_val}'")
-                else:
-                    values.append(str(val))
-            
-            cols = ', '.join([col.replace(' ', '_').lower() for col in df.columns])
-            vals = ', '.join(values)
-            sql_parts.append(f"INSERT INTO {table_name} ({cols}) VALUES ({vals});")
+        column_defs = ',\n'.join(
+            f"    {col.replace(' ', '_').lower()} {SQL_TYPES.get(str(dtype), 'TEXT')}"
+            for col, dtype in df.dtypes.items()
+        )
+        sql_parts = [
+            f"-- SQL Schema and Data for {filename}\n",
+            f"CREATE TABLE IF NOT EXISTS {table_name} (\n    id SERIAL PRIMARY KEY,\n{column_defs}\n);\n"
+        ]
+        
+        # Add a sample multi-row INSERT statement (first 5 rows)
+        cols = ', '.join([col.replace(' ', '_').lower() for col in df.columns])
+        rows = [
+            '(' + ', '.join(_sql_literal(val) for val in row) + ')'
+            for row in df.head(5).itertuples(index=False, name=None)
+        ]
+        sql_parts.append(f"\n-- Sample INSERT statement (first 5 rows)")
+        if rows:
+            sql_parts.append(f"INSERT INTO {table_name} ({cols}) VALUES\n    " + ',\n    '.join(rows) + ';')
+        
+        # Full load: stream the cleaned CSV through COPY instead of row-by-row INSERTs
+        cleaned_csv = state["cleaning_report"]["cleaned_file_path"]
+        sql_parts.append(f"\n-- Full load: stream the cleaned CSV ({cleaned_csv}) through COPY, e.g.")
+        sql_parts.append(
+            f'--   psql "$DATABASE_URL" -c "COPY {table_name} ({cols}) FROM STDIN '
+            f'WITH (FORMAT CSV, HEADER true);" < {cleaned_csv}'
+        )
         
         sql_queries = '\n'.join(sql_parts)
-        state["sql_queries"] = sql_queries
-        state["status"] = "completed"
-        
-        return state
+        return {"sql_queries": sql_queries, "status": "sql_completed"}
     
     except Exception as e:
-        state["errors"] = state.get("errors", []) + [f"SQL generation error: {str(e)}"]
-        return state
+        return {"errors": [f"SQL generation error: {str(e)}"]}
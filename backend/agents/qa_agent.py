@@ -1,20 +1,72 @@
 import pandas as pd
-from langchain_openai import ChatOpenAI
+import pyarrow.feather as feather
+from agents.llm import create_llm
 import os
+import re
+import logging
+import asyncio
+from functools import lru_cache
+from typing import Optional
 from dotenv import load_dotenv
+from agents.nodes import arrow_table_from_pandas, cleaned_arrow_path, read_csv_head, read_dataset, replace_atomically
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Initialize LLM with DeepSeek
-llm = ChatOpenAI(
-    model="deepseek/deepseek-chat",
-    openai_api_key=os.getenv("DEEPSEEK_API_KEY"),
-    openai_api_base=os.getenv("DEEPSEEK_BASE_URL"),
-    temperature=0.7
-)
+llm = create_llm(temperature=0.7)
+
+
+# Questions mentioning these need actual rows, not just the precomputed statistics
+ROW_LEVEL_PATTERN = re.compile(r'\b(rows?|examples?|samples?)\b', re.IGNORECASE)
+
+# Rows read when only a preview of the data is needed
+PREVIEW_ROWS = 1000
+
+
+@lru_cache(maxsize=32)
+def _load_arrow_table(arrow_path: str, mtime: float):
+    """Memory-map an Arrow file; mtime is part of the key so rewrites invalidate it"""
+    return feather.read_table(arrow_path, memory_map=True)
+
+
+def _excel_cache_path(file_path: str) -> str:
+    """Path of the Arrow copy of a parsed Excel upload"""
+    return f"{file_path}.arrow"
+
 
+def load_dataset(file_path: str, nrows: Optional[int] = None) -> pd.DataFrame:
+    """
+    Load a dataset for Q&A, preferring the cleaned Arrow copy written by
+    the analysis workflow over re-parsing the original upload.
+    
+    Args:
+        file_path: Path to the dataset file
+        nrows: Only load the first nrows rows (optional)
+    """
+    arrow_path = cleaned_arrow_path(file_path)
+    if not os.path.exists(arrow_path) and not file_path.endswith('.csv'):
+        # Excel parsing is slow; parse once and keep an Arrow copy for later questions
+        arrow_path = _excel_cache_path(file_path)
+        if not os.path.exists(arrow_path):
+            table = arrow_table_from_pandas(read_dataset(file_path))
+            # Atomic, so a concurrent question never memory-maps a half-written file
+            replace_atomically(arrow_path, lambda tmp: feather.write_feather(table, tmp, compression='uncompressed'))
+    
+    if os.path.exists(arrow_path):
+        table = _load_arrow_table(arrow_path, os.path.getmtime(arrow_path))
+        if nrows is not None:
+            table = table.slice(0, nrows)
+        # No self_destruct here: the cached table is reused across questions
+        return table.to_pandas(split_blocks=True)
+    
+    if nrows is not None:
+        return read_csv_head(file_path, nrows).to_pandas(split_blocks=True, self_destruct=True)
+    return read_dataset(file_path)
 
-def answer_question(file_path: str, question: str, statistics: dict = None) -> str:
+
+async def answer_question(file_path: str, question: str, statistics: dict = None) -> str:
     """
     Answer questions about the dataset using LLM
     
@@ -27,19 +79,30 @@ def answer_question(file_path: str, question: str, statistics: dict = None) -> s
         Answer to the question
     """
     try:
-        # Load dataset
-        if file_path.endswith('.csv'):
-            df = pd.read_csv(file_path)
+        if statistics:
+            # Shape and summaries are precomputed; only read a preview of the
+            # data when the question asks about individual rows
+            n_rows, n_cols = statistics['shape']
+            columns = statistics['columns']
+            preview = (
+                await asyncio.to_thread(load_dataset, file_path, PREVIEW_ROWS)
+                if ROW_LEVEL_PATTERN.search(question) else None
+            )
         else:
-            df = pd.read_excel(file_path)
+            # File reads are blocking; keep them off the event loop
+            df = await asyncio.to_thread(load_dataset, file_path)
+            n_rows, n_cols = df.shape
+            columns = df.columns.tolist()
+            preview = df
         
         # Prepare context
         context_parts = [
             f"Dataset Information:",
-            f"- Shape: {df.shape[0]} rows, {df.shape[1]} columns",
-            f"- Columns: {', '.join(df.columns.tolist())}",
-            f"\nFirst few rows:\n{df.head(3).to_string()}",
+            f"- Shape: {n_rows} rows, {n_cols} columns",
+            f"- Columns: {', '.join(map(str, columns))}",
         ]
+        if preview is not None:
+            context_parts.append(f"\nFirst few rows:\n{preview.head(3).to_string()}")
         
         # Add statistics if available
         if statistics:
@@ -68,15 +131,15 @@ Provide a clear, data-driven answer. If you need to perform calculations, show y
 Answer:"""
         
         # Get response from LLM
-        response = llm.invoke(prompt)
+        response = await llm.ainvoke(prompt)
         return response.content
     
     except Exception as e:
         error_msg = str(e)
-        print(f"DEBUG: Caught exception in answer_question: {error_msg}")
+        logger.exception("Question answering failed")
         
         if "402" in error_msg or "Insufficient Balance" in error_msg or "insufficient_quota" in error_msg or "404" in error_msg or "Not Found" in error_msg:
-            print("API Error: Insufficient Balance or Not Found. Falling back to mock answer.")
+            logger.warning("LLM API unavailable, falling back to mock answer")
             return "I apologize, but I'm currently running in Mock Mode due to API limits. I cannot provide specific answers to your questions at this time, but you can still view the generated statistics and visualizations."
             
         return f"Error answering question: {error_msg}"
@@ -12,8 +12,8 @@ class AgentState(TypedDict):
     filename: str
     
     # Data processing
-    raw_data: Optional[Any]  # pandas DataFrame
-    cleaned_data: Optional[Any]  # pandas DataFrame
+    raw_shape: Optional[tuple]  # (rows, columns) of the file as loaded
+    cleaned_data: Optional[str]  # Path to the cleaned Arrow (Feather) file
     cleaning_report: Optional[Dict[str, Any]]
     
     # Analysis results
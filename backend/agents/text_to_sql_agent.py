@@ -5,25 +5,269 @@ Converts natural language questions to valid PostgreSQL queries using dataset sc
 
 import os
 import re
+import logging
+import json
+import asyncio
+import time
+import hashlib
+import sqlite3
+import difflib
+from contextlib import closing
+from functools import lru_cache
+import numpy as np
 import pandas as pd
-from typing import Dict, Optional
+import pyarrow as pa
+from typing import Dict, List, Optional
 from sqlalchemy.orm import Session
-from langchain_openai import ChatOpenAI
+from langchain_openai import OpenAIEmbeddings
 from langchain.prompts import ChatPromptTemplate
+from agents.llm import create_llm, http_async_client, http_client
+from agents.nodes import read_csv_schema
+
+logger = logging.getLogger(__name__)
 
 # Initialize LLM with DeepSeek
-llm = ChatOpenAI(
-    model="deepseek/deepseek-chat",
-    openai_api_key=os.getenv("DEEPSEEK_API_KEY"),
-    openai_api_base=os.getenv("DEEPSEEK_BASE_URL"),
-    temperature=0.1  # Low temperature for more deterministic SQL generation
+# A single query rarely needs more than a few hundred tokens; the cap bounds
+# the cost and latency of a runaway completion
+SQL_MAX_TOKENS = 512
+llm = create_llm(
+    temperature=0.1,  # Low temperature for more deterministic SQL generation
+    max_tokens=SQL_MAX_TOKENS,
+    streaming=True
 )
 
+# Prompt layout matters for provider-side prefix caching: everything that is
+# stable for a dataset (rules, schema, columns) forms the system message prefix,
+# and the per-call question is the only content after it.
+SQL_SYSTEM_PROMPT = """You are a PostgreSQL SQL query generator. Your task is to convert natural language questions into valid PostgreSQL SQL queries.
+
+CRITICAL RULES:
+1. Output ONLY the SQL query - no explanations, no markdown, no code blocks
+2. Use ONLY the columns provided in the schema below
+3. Do NOT invent or hallucinate column names
+4. If the question is ambiguous or unclear, respond with EXACTLY: "CLARIFICATION NEEDED: [your specific question]"
+5. Use proper PostgreSQL syntax
+6. Always use the exact table name provided
+7. For aggregations, use appropriate GROUP BY clauses
+8. End the query with a semicolon
+
+Table Schema:
+Table name: {table_name}
+Columns:
+{schema_text}
+
+Available columns (use ONLY these): {column_list}"""
+
+SQL_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", SQL_SYSTEM_PROMPT),
+    ("human", "{question}")
+])
+
+# Batch mode shares the system prefix, so its tokens are paid once for all questions
+SQL_BATCH_MAX_QUESTIONS = 16
+SQL_BATCH_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", SQL_SYSTEM_PROMPT),
+    ("human", """Answer each numbered question below independently, following the rules above.
+Respond with a JSON array of {{"id": <question number>, "sql": "<query or CLARIFICATION NEEDED: ...>"}} objects, one per question, and nothing else.
+
+{questions}""")
+])
+
+# Exact-match cache of validated SQL, keyed on the fully rendered prompt
+SQL_CACHE_PATH = os.getenv("SQL_CACHE_PATH", "./.sql_cache.db")
+SQL_CACHE_TTL = int(os.getenv("SQL_CACHE_TTL", "86400"))  # seconds
+
+# Semantic cache: reuse SQL from an earlier, differently worded question on the
+# same dataset/schema. Only enabled when an embeddings API key is configured and
+# generation is near-deterministic, so a cached answer is what the LLM would give.
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))  # cosine similarity
+embeddings = OpenAIEmbeddings(
+    model=os.getenv("EMBEDDINGS_MODEL", "text-embedding-3-small"),
+    openai_api_key=os.getenv("EMBEDDINGS_API_KEY"),
+    openai_api_base=os.getenv("EMBEDDINGS_BASE_URL"),
+    max_retries=2,
+    http_async_client=http_async_client,
+    http_client=http_client
+) if os.getenv("EMBEDDINGS_API_KEY") and llm.temperature <= 0.1 else None
+
+with closing(sqlite3.connect(SQL_CACHE_PATH)) as _conn, _conn:
+    _conn.execute(
+        "CREATE TABLE IF NOT EXISTS sql_cache (key TEXT PRIMARY KEY, value TEXT, expires INTEGER)"
+    )
+    # Tables from before entries expired are just cache; recreate them
+    _columns = {row[1] for row in _conn.execute("PRAGMA table_info(sql_semantic_cache)")}
+    if _columns and "expires" not in _columns:
+        _conn.execute("DROP TABLE sql_semantic_cache")
+    _conn.execute(
+        "CREATE TABLE IF NOT EXISTS sql_semantic_cache "
+        "(dataset_id INTEGER, schema_hash TEXT, question TEXT, embedding BLOB, value TEXT, expires INTEGER)"
+    )
+    _conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_sql_semantic_cache_question "
+        "ON sql_semantic_cache (dataset_id, schema_hash, question)"
+    )
+
+
+# Single-flight: prompt cache key -> future of the LLM call currently generating it
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+class _GenerationCancelled(Exception):
+    """Set on a single-flight future whose leading request was cancelled"""
+
+
+def _cache_key(messages) -> str:
+    """SHA256 over the model name and rendered prompt (question, table, schema)"""
+    payload = "\x1f".join([llm.model_name] + [f"{m.type}:{m.content}" for m in messages])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _cache_get(key: str) -> Optional[str]:
+    with closing(sqlite3.connect(SQL_CACHE_PATH)) as conn:
+        row = conn.execute(
+            "SELECT value FROM sql_cache WHERE key = ? AND expires > ?",
+            (key, int(time.time()))
+        ).fetchone()
+    return row[0] if row else None
+
+
+def _cache_put(key: str, value: str) -> None:
+    with closing(sqlite3.connect(SQL_CACHE_PATH)) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO sql_cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, value, int(time.time()) + SQL_CACHE_TTL)
+        )
+
+
+async def _embed_question(question: str) -> Optional[np.ndarray]:
+    """Unit-length embedding of the question, or None if the semantic cache is off/unavailable"""
+    if embeddings is None:
+        return None
+    try:
+        vector = np.asarray(await embeddings.aembed_query(question), dtype=np.float32)
+    except Exception as e:
+        logger.warning("Semantic cache embedding failed: %s", e)
+        return None
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+def _semantic_cache_get(dataset_id: int, schema_hash: str, vector: np.ndarray) -> Optional[str]:
+    """Cached SQL of the most similar earlier question, if similar enough"""
+    with closing(sqlite3.connect(SQL_CACHE_PATH)) as conn:
+        rows = conn.execute(
+            "SELECT embedding, value FROM sql_semantic_cache "
+            "WHERE dataset_id = ? AND schema_hash = ? AND expires > ?",
+            (dataset_id, schema_hash, int(time.time()))
+        ).fetchall()
+    if not rows:
+        return None
+    
+    matrix = np.stack([np.frombuffer(emb, dtype=np.float32) for emb, _ in rows])
+    similarities = matrix @ vector
+    best = int(np.argmax(similarities))
+    return rows[best][1] if similarities[best] >= SEMANTIC_CACHE_THRESHOLD else None
+
+
+def _semantic_cache_put(dataset_id: int, schema_hash: str, question: str, vector: np.ndarray, value: str) -> None:
+    now = int(time.time())
+    with closing(sqlite3.connect(SQL_CACHE_PATH)) as conn, conn:
+        # Evict expired entries so lookups don't scan an ever-growing table
+        conn.execute("DELETE FROM sql_semantic_cache WHERE expires <= ?", (now,))
+        conn.execute(
+            "INSERT INTO sql_semantic_cache (dataset_id, schema_hash, question, embedding, value, expires) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (dataset_id, schema_hash, question) DO UPDATE SET "
+            "embedding = excluded.embedding, value = excluded.value, expires = excluded.expires",
+            (dataset_id, schema_hash, question, vector.tobytes(), value, now + SQL_CACHE_TTL)
+        )
+
+
+# Rows sampled to infer column types; the whole file isn't needed for a schema
+SCHEMA_SAMPLE_ROWS = 1000
+
+
+def schema_from_dataframe(df: pd.DataFrame) -> Dict[str, str]:
+    """
+    Map DataFrame columns to PostgreSQL types.
+    
+    Args:
+        df: DataFrame (or a sample of one)
+        
+    Returns:
+        Dictionary mapping column names to their data types
+    """
+    schema = {}
+    for col in df.columns:
+        dtype = str(df[col].dtype)
+        
+        # Map pandas dtypes to PostgreSQL types
+        if dtype.startswith('int'):
+            pg_type = 'INTEGER'
+        elif dtype.startswith('float'):
+            pg_type = 'NUMERIC'
+        elif dtype == 'bool':
+            pg_type = 'BOOLEAN'
+        elif dtype == 'datetime64':
+            pg_type = 'TIMESTAMP'
+        else:
+            pg_type = 'TEXT'
+        
+        schema[col] = pg_type
+    
+    return schema
+
+
+def schema_from_arrow(arrow_schema: pa.Schema) -> Dict[str, str]:
+    """
+    Map Arrow column types to PostgreSQL types.
+    
+    Args:
+        arrow_schema: Schema inferred by the Arrow CSV reader
+        
+    Returns:
+        Dictionary mapping column names to their data types
+    """
+    schema = {}
+    for field in arrow_schema:
+        arrow_type = field.type
+        
+        if pa.types.is_integer(arrow_type):
+            pg_type = 'INTEGER'
+        elif pa.types.is_floating(arrow_type) or pa.types.is_decimal(arrow_type):
+            pg_type = 'NUMERIC'
+        elif pa.types.is_boolean(arrow_type):
+            pg_type = 'BOOLEAN'
+        elif pa.types.is_timestamp(arrow_type):
+            pg_type = 'TIMESTAMP'
+        else:
+            pg_type = 'TEXT'
+        
+        schema[field.name] = pg_type
+    
+    return schema
+
+
+@lru_cache(maxsize=256)
+def _extract_schema_cached(file_path: str, mtime: float) -> Dict[str, str]:
+    # mtime is part of the cache key so a rewritten file is re-read
+    if file_path.endswith('.csv'):
+        # The streaming reader infers types from the first block only
+        return schema_from_arrow(read_csv_schema(file_path))
+    elif file_path.endswith(('.xlsx', '.xls')):
+        df = pd.read_excel(file_path, nrows=SCHEMA_SAMPLE_ROWS, engine="calamine")
+    else:
+        raise ValueError(f"Unsupported file format: {file_path}")
+    return schema_from_dataframe(df)
+
 
 def extract_schema_from_dataset(file_path: str) -> Dict[str, str]:
     """
     Extract schema information from a dataset file.
     
+    Types are inferred from the first block of a CSV (first SCHEMA_SAMPLE_ROWS
+    rows of a workbook) and the result is cached per (file_path, mtime). This is
+    provisional: once the dataset is analyzed, schema_from_cleaned_data replaces it.
+    
     Args:
         file_path: Path to the CSV/Excel file
         
@@ -31,40 +275,58 @@ def extract_schema_from_dataset(file_path: str) -> Dict[str, str]:
         Dictionary mapping column names to their data types
     """
     try:
-        # Read the dataset
-        if file_path.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        elif file_path.endswith(('.xlsx', '.xls')):
-            df = pd.read_excel(file_path)
-        else:
-            raise ValueError(f"Unsupported file format: {file_path}")
-        
-        # Extract schema
-        schema = {}
-        for col in df.columns:
-            dtype = str(df[col].dtype)
-            
-            # Map pandas dtypes to PostgreSQL types
-            if dtype.startswith('int'):
-                pg_type = 'INTEGER'
-            elif dtype.startswith('float'):
-                pg_type = 'NUMERIC'
-            elif dtype == 'bool':
-                pg_type = 'BOOLEAN'
-            elif dtype == 'datetime64':
-                pg_type = 'TIMESTAMP'
-            else:
-                pg_type = 'TEXT'
-            
-            schema[col] = pg_type
-        
-        return schema
+        # Copy so callers can't mutate the cached dict
+        return dict(_extract_schema_cached(file_path, os.path.getmtime(file_path)))
     
-    except Exception as e:
-        print(f"Error extracting schema: {str(e)}")
+    except Exception:
+        logger.exception("Schema extraction failed for %s", file_path)
         return {}
 
 
+def schema_from_cleaned_data(arrow_path: str) -> Dict[str, str]:
+    """
+    Schema of the cleaned Arrow file written by clean_data_node.
+    
+    Its types come from the full file after cleaning, so they match what
+    clean_data_node and generate_sql_node produce.
+    
+    Args:
+        arrow_path: Path to the cleaned Arrow (Feather) file
+        
+    Returns:
+        Dictionary mapping column names to their data types
+    """
+    with pa.memory_map(arrow_path) as source:
+        arrow_schema = pa.ipc.open_file(source).schema
+    # Skip the pandas index column stored alongside the data
+    return {
+        name: pg_type
+        for name, pg_type in schema_from_arrow(arrow_schema).items()
+        if not name.startswith("__index_level_")
+    }
+
+
+# Potential column references (simple regex, not perfect but good enough)
+_IDENTIFIER_RE = re.compile(r'\b([a-z_][a-z0-9_]*)\b')
+# Double-quoted identifiers, e.g. "Unit Price" ("" escapes a quote)
+_QUOTED_IDENTIFIER_RE = re.compile(r'"((?:[^"]|"")+)"')
+
+# SQL keywords that are never column references
+_SQL_KEYWORDS = frozenset({
+    'select', 'from', 'where', 'group', 'by', 'order', 'having', 'limit',
+    'offset', 'join', 'inner', 'left', 'right', 'outer', 'on', 'as',
+    'and', 'or', 'not', 'in', 'like', 'between', 'is', 'null', 'distinct',
+    'count', 'sum', 'avg', 'min', 'max', 'case', 'when', 'then', 'else',
+    'end', 'asc', 'desc', 'true', 'false', 'cast', 'integer', 'text',
+    'numeric', 'boolean', 'timestamp', 'date', 'varchar', 'char'
+})
+
+
+@lru_cache(maxsize=256)
+def _lowercase_columns(valid_columns: tuple) -> frozenset:
+    return frozenset(col.lower() for col in valid_columns)
+
+
 def validate_sql_columns(sql: str, valid_columns: list) -> tuple[bool, list]:
     """
     Validate that SQL query only references columns that exist in the schema.
@@ -76,40 +338,278 @@ def validate_sql_columns(sql: str, valid_columns: list) -> tuple[bool, list]:
     Returns:
         Tuple of (is_valid, invalid_columns)
     """
-    # Convert to lowercase for case-insensitive comparison
-    sql_lower = sql.lower()
-    valid_columns_lower = [col.lower() for col in valid_columns]
-    
-    # Extract potential column references (simple regex, not perfect but good enough)
-    # Matches words that could be column names
-    potential_columns = re.findall(r'\b([a-z_][a-z0-9_]*)\b', sql_lower)
-    
-    # Filter out SQL keywords
-    sql_keywords = {
-        'select', 'from', 'where', 'group', 'by', 'order', 'having', 'limit',
-        'offset', 'join', 'inner', 'left', 'right', 'outer', 'on', 'as',
-        'and', 'or', 'not', 'in', 'like', 'between', 'is', 'null', 'distinct',
-        'count', 'sum', 'avg', 'min', 'max', 'case', 'when', 'then', 'else',
-        'end', 'asc', 'desc', 'true', 'false', 'cast', 'integer', 'text',
-        'numeric', 'boolean', 'timestamp', 'date', 'varchar', 'char'
-    }
+    # Case-insensitive comparison; the lowered column set is cached per schema
+    valid_columns_lower = _lowercase_columns(tuple(valid_columns))
+    
+    # Quoted identifiers are whole column names; check them as such, then drop
+    # them so their words aren't mistaken for separate identifiers
+    quoted_columns = dict.fromkeys(
+        name.replace('""', '"').lower() for name in _QUOTED_IDENTIFIER_RE.findall(sql)
+    )
+    sql = _QUOTED_IDENTIFIER_RE.sub(' ', sql)
     
-    # Check for invalid columns
-    invalid_columns = []
-    for col in potential_columns:
-        if col not in sql_keywords and col not in valid_columns_lower:
-            # Check if it might be a table name (e.g., dataset_1)
-            if not col.startswith('dataset_'):
-                invalid_columns.append(col)
+    # Each distinct identifier only needs checking once (dict keeps first-seen order)
+    potential_columns = dict.fromkeys(_IDENTIFIER_RE.findall(sql.lower()))
+    
+    # Check for invalid columns, ignoring table names (e.g., dataset_1)
+    invalid_columns = [
+        col for col in quoted_columns
+        if col not in valid_columns_lower
+        and not col.startswith('dataset_')
+    ] + [
+        col for col in potential_columns
+        if col not in _SQL_KEYWORDS
+        and col not in valid_columns_lower
+        and not col.startswith('dataset_')
+    ]
     
     return len(invalid_columns) == 0, invalid_columns
 
 
-def generate_sql_query(
+# Trivial questions answered from templates, without an LLM call
+_COUNT_RE = re.compile(
+    r'^(?:how many rows(?: are there)?|count(?: all)?(?: rows)?|number of rows|row count)\s*\??$'
+)
+_HEAD_RE = re.compile(
+    r'^(?:show|list|head|display)(?: me)?(?: the)?(?: first| top)? (\d+)(?: rows| records)?\s*$'
+)
+_AGGREGATE_RE = re.compile(
+    r'^(?:what is )?(?:the )?(sum|total|average|avg|mean|min|minimum|max|maximum) (?:of )?(.+?)'
+    r'(?: (?:by|per) (.+?))?\s*\??$'
+)
+_AGGREGATES = {
+    'sum': 'SUM', 'total': 'SUM', 'average': 'AVG', 'avg': 'AVG', 'mean': 'AVG',
+    'min': 'MIN', 'minimum': 'MIN', 'max': 'MAX', 'maximum': 'MAX'
+}
+_NUMERIC_TYPES = frozenset({'INTEGER', 'NUMERIC'})
+_SIMPLE_IDENTIFIER_RE = re.compile(r'[a-z_][a-z0-9_]*')
+
+
+def _quote_identifier(name: str) -> str:
+    # Schema column names as-is, like the LLM path and validate_sql_columns
+    if _SIMPLE_IDENTIFIER_RE.fullmatch(name):
+        return name
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _match_column(text: str, schema: Dict[str, str]) -> Optional[str]:
+    """Schema column named by a phrase ("unit price" -> "Unit_Price"), if any"""
+    normalized = {re.sub(r'[\s_]+', ' ', col.lower()).strip(): col for col in schema}
+    phrase = re.sub(r'[\s_]+', ' ', text.lower()).strip()
+    if phrase in normalized:
+        return normalized[phrase]
+    matches = difflib.get_close_matches(phrase, list(normalized), n=1, cutoff=0.85)
+    return normalized[matches[0]] if matches else None
+
+
+def fast_path_sql(question: str, schema: Dict[str, str], table_name: str) -> Optional[str]:
+    """
+    SQL for trivial questions (row counts, first N rows, single-column aggregates).
+    
+    Args:
+        question: Natural language question
+        schema: Column name -> PostgreSQL type
+        table_name: Table to query
+        
+    Returns:
+        SQL query, or None if the question needs the LLM
+    """
+    q = question.strip().lower()
+    
+    if _COUNT_RE.match(q):
+        return f"SELECT COUNT(*) FROM {table_name};"
+    
+    match = _HEAD_RE.match(q)
+    if match:
+        return f"SELECT * FROM {table_name} LIMIT {int(match.group(1))};"
+    
+    match = _AGGREGATE_RE.match(q)
+    if match:
+        func = _AGGREGATES[match.group(1)]
+        column = _match_column(match.group(2), schema)
+        if column is None or (func in ('SUM', 'AVG') and schema[column] not in _NUMERIC_TYPES):
+            return None
+        target = _quote_identifier(column)
+        
+        if match.group(3) is None:
+            return f"SELECT {func}({target}) FROM {table_name};"
+        group_column = _match_column(match.group(3), schema)
+        if group_column is None:
+            return None
+        group = _quote_identifier(group_column)
+        return f"SELECT {group}, {func}({target}) FROM {table_name} GROUP BY {group} ORDER BY {group};"
+    
+    return None
+
+
+def render_schema(schema: Dict[str, str]) -> Dict[str, str]:
+    """
+    Render a schema for the system prompt.
+    
+    Done once at upload and stored on the dataset, so every request for a
+    dataset sends a byte-identical prompt prefix.
+    
+    Args:
+        schema: Column name -> PostgreSQL type
+        
+    Returns:
+        Dictionary with schema_text and column_list
+    """
+    # Column order comes from the file, so the rendering is deterministic
+    schema_lines = [f"  {col} {dtype}" for col, dtype in schema.items()]
+    return {
+        "schema_text": ",\n".join(schema_lines),
+        "column_list": ", ".join(schema.keys())
+    }
+
+
+def _schema_prompt_vars(
+    schema: Dict[str, str],
+    table_name: str,
+    schema_text: Optional[str],
+    column_list: Optional[str]
+) -> Dict[str, str]:
+    """Template variables for the system prompt, rendering the schema only if not stored"""
+    if schema_text is None or column_list is None:
+        return {"table_name": table_name, **render_schema(schema)}
+    return {"table_name": table_name, "schema_text": schema_text, "column_list": column_list}
+
+
+CLARIFICATION_PREFIX = "CLARIFICATION NEEDED:"
+
+
+def _clarification_question(output: str, finished: bool) -> Optional[str]:
+    """
+    The clarification question in streamed output, or None if it isn't complete yet.
+    
+    The question runs from after the prefix up to its first question mark. Once
+    the stream has ended without one, it falls back to the first non-empty line.
+    Mid-stream a line break isn't treated as the end, since the model may put
+    context on one line and the question on the next.
+    """
+    rest = output.lstrip()[len(CLARIFICATION_PREFIX):].lstrip()
+    end = rest.find("?")
+    if end != -1:
+        return rest[:end + 1]
+    if not finished:
+        return None
+    return rest.split("\n", 1)[0].strip()
+
+
+def _is_complete(output: str) -> bool:
+    """Whether streamed output already holds everything we'll use"""
+    text = output.lstrip()
+    if text.startswith(CLARIFICATION_PREFIX):
+        return _clarification_question(text, finished=False) is not None
+    # Rule 8: the query ends with a semicolon (outside of a string literal)
+    return text.rstrip().endswith(";") and text.count("'") % 2 == 0
+
+
+async def _astream_sql(messages, dataset_id: int) -> str:
+    """Stream a completion, stopping as soon as the SQL or clarification is complete"""
+    output = ""
+    # prompt_cache_key routes same-dataset requests to the same provider cache
+    stream = llm.astream(messages, extra_body={"prompt_cache_key": f"dataset_{dataset_id}"})
+    try:
+        async for chunk in stream:
+            output += chunk.content
+            if _is_complete(output):
+                break
+    finally:
+        # Closing the stream drops the connection, so generation stops server-side
+        await stream.aclose()
+    
+    if output.lstrip().startswith(CLARIFICATION_PREFIX):
+        # Drop anything the model wrote after the question
+        output = f"{CLARIFICATION_PREFIX} {_clarification_question(output, finished=True)}"
+    return output
+
+
+def _sql_success(sql_query: str, schema: Dict[str, str], table_name: str) -> Dict:
+    return {
+        "sql_query": sql_query,
+        "needs_clarification": False,
+        "clarification_message": None,
+        "table_name": table_name,
+        "schema": schema
+    }
+
+
+def _sql_result(sql_output: str, schema: Dict[str, str], table_name: str) -> Dict:
+    """Turn raw model output into a result dict (clarification, cleanup, validation)"""
+    sql_output = sql_output.strip()
+    
+    # Check if clarification is needed
+    if sql_output.startswith(CLARIFICATION_PREFIX):
+        clarification_msg = sql_output.replace(CLARIFICATION_PREFIX, "").strip()
+        return {
+            "sql_query": None,
+            "needs_clarification": True,
+            "clarification_message": clarification_msg
+        }
+    
+    # Clean up the SQL (remove markdown if present)
+    sql_output = sql_output.replace("```sql", "").replace("```", "").strip()
+    
+    # Validate columns
+    is_valid, invalid_cols = validate_sql_columns(sql_output, list(schema.keys()))
+    
+    if not is_valid:
+        return {
+            "sql_query": None,
+            "needs_clarification": True,
+            "clarification_message": f"The generated query references columns that don't exist: {', '.join(invalid_cols)}. Available columns are: {', '.join(schema.keys())}"
+        }
+    
+    return _sql_success(sql_output, schema, table_name)
+
+
+def _error_result(e: Exception) -> Dict:
+    error_msg = str(e)
+    logger.error("SQL generation failed: %s", error_msg, exc_info=e)
+    
+    # Check for API errors
+    if "402" in error_msg or "Insufficient Balance" in error_msg or "404" in error_msg:
+        return {
+            "sql_query": None,
+            "needs_clarification": True,
+            "clarification_message": "AI service is currently unavailable (Mock Mode). Please try again later."
+        }
+    
+    return {
+        "sql_query": None,
+        "needs_clarification": True,
+        "clarification_message": f"Error generating SQL query: {error_msg}"
+    }
+
+
+def _parse_batch_response(content: str, count: int) -> Dict[int, str]:
+    """Map question number -> raw SQL from a batch response; raises ValueError if malformed"""
+    content = content.strip().replace("```json", "").replace("```", "").strip()
+    items = json.loads(content)
+    if not isinstance(items, list):
+        raise ValueError("Batch response is not a JSON array")
+    
+    outputs = {}
+    for item in items:
+        if isinstance(item, dict) and isinstance(item.get("sql"), str):
+            try:
+                idx = int(item.get("id"))
+            except (TypeError, ValueError):
+                continue
+            if 1 <= idx <= count:
+                outputs[idx] = item["sql"]
+    return outputs
+
+
+async def agenerate_sql_query(
     question: str,
     dataset_id: int,
     file_path: str,
-    table_name: Optional[str] = None
+    table_name: Optional[str] = None,
+    schema: Optional[Dict[str, str]] = None,
+    schema_text: Optional[str] = None,
+    column_list: Optional[str] = None
 ) -> Dict:
     """
     Generate a PostgreSQL query from a natural language question.
@@ -119,13 +619,17 @@ def generate_sql_query(
         dataset_id: ID of the dataset
         file_path: Path to the dataset file
         table_name: Optional table name (defaults to dataset_{dataset_id})
+        schema: Pre-extracted schema (optional, skips reading the file)
+        schema_text: Pre-rendered schema (optional, see render_schema)
+        column_list: Pre-rendered column list (optional, see render_schema)
         
     Returns:
         Dictionary with sql_query, needs_clarification, and clarification_message
     """
     try:
-        # Extract schema
-        schema = extract_schema_from_dataset(file_path)
+        # Extract schema (file parsing is blocking; keep it off the event loop)
+        if not schema:
+            schema = await asyncio.to_thread(extract_schema_from_dataset, file_path)
         
         if not schema:
             return {
@@ -136,87 +640,167 @@ def generate_sql_query(
         
         # Build schema description
         table_name = table_name or f"dataset_{dataset_id}"
-        schema_lines = [f"  {col} {dtype}" for col, dtype in schema.items()]
-        schema_text = ",\n".join(schema_lines)
         
-        # Create prompt
-        prompt_template = ChatPromptTemplate.from_messages([
-            ("system", """You are a PostgreSQL SQL query generator. Your task is to convert natural language questions into valid PostgreSQL SQL queries.
-
-CRITICAL RULES:
-1. Output ONLY the SQL query - no explanations, no markdown, no code blocks
-2. Use ONLY the columns provided in the schema below
-3. Do NOT invent or hallucinate column names
-4. If the question is ambiguous or unclear, respond with EXACTLY: "CLARIFICATION NEEDED: [your specific question]"
-5. Use proper PostgreSQL syntax
-6. Always use the exact table name provided
-7. For aggregations, use appropriate GROUP BY clauses
-8. End the query with a semicolon
-
-Table Schema:
-Table name: {table_name}
-Columns:
-{schema_text}
-
-Available columns (use ONLY these): {column_list}"""),
-            ("human", "{question}")
-        ])
+        # Trivial questions don't need the LLM at all
+        fast_sql = fast_path_sql(question, schema, table_name)
+        if fast_sql is not None:
+            # Validated like LLM output, so both paths accept exactly the same SQL
+            return _sql_result(fast_sql, schema, table_name)
         
-        # Generate SQL
-        chain = prompt_template | llm
-        response = chain.invoke({
-            "table_name": table_name,
-            "schema_text": schema_text,
-            "column_list": ", ".join(schema.keys()),
-            "question": question
-        })
+        prompt_vars = _schema_prompt_vars(schema, table_name, schema_text, column_list)
+        messages = SQL_PROMPT.format_messages(question=question, **prompt_vars)
         
-        sql_output = response.content.strip()
+        # Identical prompt already answered: skip the LLM round-trip
+        cache_key = _cache_key(messages)
+        cached_sql = await asyncio.to_thread(_cache_get, cache_key)
         
-        # Check if clarification is needed
-        if sql_output.startswith("CLARIFICATION NEEDED:"):
-            clarification_msg = sql_output.replace("CLARIFICATION NEEDED:", "").strip()
-            return {
-                "sql_query": None,
-                "needs_clarification": True,
-                "clarification_message": clarification_msg
-            }
+        # Otherwise look for a paraphrase of an earlier question on this schema
+        schema_hash = hashlib.sha256(prompt_vars["schema_text"].encode("utf-8")).hexdigest()
+        question_vector = None
+        if cached_sql is None:
+            question_vector = await _embed_question(question)
+            if question_vector is not None:
+                cached_sql = await asyncio.to_thread(_semantic_cache_get, dataset_id, schema_hash, question_vector)
         
-        # Clean up the SQL (remove markdown if present)
-        sql_output = sql_output.replace("```sql", "").replace("```", "").strip()
+        if cached_sql is not None:
+            return _sql_success(cached_sql, schema, table_name)
         
-        # Validate columns
-        is_valid, invalid_cols = validate_sql_columns(sql_output, list(schema.keys()))
+        # Identical prompt already being generated: share that LLM call.
+        # Nothing awaits between the lookup and the insert, so no lock is needed.
+        while (future := _inflight.get(cache_key)) is not None:
+            try:
+                return dict(await asyncio.shield(future))
+            except _GenerationCancelled:
+                # The other request was cancelled, not failed; generate (or join) anew
+                continue
+        future = _inflight[cache_key] = asyncio.get_running_loop().create_future()
         
-        if not is_valid:
-            return {
-                "sql_query": None,
-                "needs_clarification": True,
-                "clarification_message": f"The generated query references columns that don't exist: {', '.join(invalid_cols)}. Available columns are: {', '.join(schema.keys())}"
-            }
-        
-        return {
-            "sql_query": sql_output,
-            "needs_clarification": False,
-            "clarification_message": None,
-            "table_name": table_name,
-            "schema": schema
-        }
+        try:
+            # Generate SQL
+            sql_output = await _astream_sql(messages, dataset_id)
+            
+            result = _sql_result(sql_output, schema, table_name)
+            
+            # Only validated SQL is cached, so bad outputs can't poison the cache
+            if result["sql_query"] is not None:
+                await asyncio.to_thread(_cache_put, cache_key, result["sql_query"])
+                if question_vector is not None:
+                    await asyncio.to_thread(
+                        _semantic_cache_put, dataset_id, schema_hash, question, question_vector, result["sql_query"]
+                    )
+            
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            if not future.done():  # This request was cancelled mid-call
+                future.set_exception(_GenerationCancelled())
+            future.exception()  # Mark retrieved; there may be no waiters
+            del _inflight[cache_key]
     
     except Exception as e:
-        error_msg = str(e)
-        print(f"Error generating SQL: {error_msg}")
-        
-        # Check for API errors
-        if "402" in error_msg or "Insufficient Balance" in error_msg or "404" in error_msg:
-            return {
-                "sql_query": None,
-                "needs_clarification": True,
-                "clarification_message": "AI service is currently unavailable (Mock Mode). Please try again later."
-            }
+        return _error_result(e)
+
+
+async def agenerate_sql_batch(
+    questions: List[str],
+    dataset_id: int,
+    file_path: str,
+    table_name: Optional[str] = None,
+    schema: Optional[Dict[str, str]] = None,
+    schema_text: Optional[str] = None,
+    column_list: Optional[str] = None
+) -> List[Dict]:
+    """
+    Generate PostgreSQL queries for several questions in a single LLM call.
+    
+    The schema preamble is sent once for the whole batch. Questions the model
+    doesn't answer (or an unparseable response) fall back to agenerate_sql_query.
+    
+    Args:
+        questions: Natural language questions (at most SQL_BATCH_MAX_QUESTIONS)
+        dataset_id: ID of the dataset
+        file_path: Path to the dataset file
+        table_name: Optional table name (defaults to dataset_{dataset_id})
+        schema: Pre-extracted schema (optional, skips reading the file)
+        schema_text: Pre-rendered schema (optional, see render_schema)
+        column_list: Pre-rendered column list (optional, see render_schema)
         
-        return {
+    Returns:
+        List of result dictionaries, in the same order as questions
+    """
+    if len(questions) > SQL_BATCH_MAX_QUESTIONS:
+        raise ValueError(f"At most {SQL_BATCH_MAX_QUESTIONS} questions per batch")
+    
+    if not schema:
+        schema = await asyncio.to_thread(extract_schema_from_dataset, file_path)
+    
+    if not schema:
+        return [{
             "sql_query": None,
             "needs_clarification": True,
-            "clarification_message": f"Error generating SQL query: {error_msg}"
-        }
+            "clarification_message": "Unable to extract schema from dataset. Please ensure the file is valid."
+        } for _ in questions]
+    
+    table_name = table_name or f"dataset_{dataset_id}"
+    prompt_vars = _schema_prompt_vars(schema, table_name, schema_text, column_list)
+    
+    # Serve template and exact-match cache hits; only the rest go to the LLM
+    results: List[Optional[Dict]] = [None] * len(questions)
+    cache_keys = []
+    for i, question in enumerate(questions):
+        fast_sql = fast_path_sql(question, schema, table_name)
+        if fast_sql is not None:
+            results[i] = _sql_result(fast_sql, schema, table_name)
+            cache_keys.append(None)
+            continue
+        key = _cache_key(SQL_PROMPT.format_messages(question=question, **prompt_vars))
+        cache_keys.append(key)
+        cached_sql = await asyncio.to_thread(_cache_get, key)
+        if cached_sql is not None:
+            results[i] = _sql_success(cached_sql, schema, table_name)
+    pending = [i for i, result in enumerate(results) if result is None]
+    
+    if pending:
+        numbered = "\n".join(f"{n}. {questions[i]}" for n, i in enumerate(pending, start=1))
+        messages = SQL_BATCH_PROMPT.format_messages(questions=numbered, **prompt_vars)
+        
+        try:
+            response = await llm.ainvoke(
+                messages,
+                max_tokens=SQL_MAX_TOKENS * len(pending),  # Room for every answer in the batch
+                extra_body={"prompt_cache_key": f"dataset_{dataset_id}"}
+            )
+        except Exception as e:
+            error = _error_result(e)
+            for i in pending:
+                results[i] = dict(error)
+            return results
+        
+        try:
+            outputs = _parse_batch_response(response.content, len(pending))
+        except ValueError as e:
+            logger.warning("Batch SQL response not parseable, falling back to per-question mode: %s", e)
+            outputs = {}
+        
+        for n, i in enumerate(pending, start=1):
+            if n in outputs:
+                results[i] = _sql_result(outputs[n], schema, table_name)
+                if results[i]["sql_query"] is not None:
+                    await asyncio.to_thread(_cache_put, cache_keys[i], results[i]["sql_query"])
+        
+        # Anything the batch didn't answer is retried one question at a time
+        missing = [i for i in pending if results[i] is None]
+        if missing:
+            fallback = await asyncio.gather(*(
+                agenerate_sql_query(
+                    questions[i], dataset_id, file_path, table_name, schema, schema_text, column_list
+                )
+                for i in missing
+            ))
+            for i, result in zip(missing, fallback):
+                results[i] = result
+    
+    return results
@@ -1,7 +1,10 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text, inspect, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.types import TypeDecorator
 from dotenv import load_dotenv
+import orjson
+import zstandard
 import os
 
 # Load environment variables
@@ -22,6 +25,27 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 
+ZSTD_LEVEL = 10
+
+
+class ZstdJSON(TypeDecorator):
+    """JSON value stored zstd-compressed in a BYTEA column"""
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(
+            orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        )
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return orjson.loads(zstandard.ZstdDecompressor().decompress(value))
+
+
 def get_db():
     """Dependency for getting database session"""
     db = SessionLocal()
@@ -31,6 +55,78 @@ def get_db():
         db.close()
 
 
+def _to_jsonb(table: str, column: str) -> str:
+    """DDL converting a json column to jsonb, skipped once it already is"""
+    return f"""
+    DO $$ BEGIN
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = '{table}' AND column_name = '{column}' AND data_type = 'json'
+        ) THEN
+            ALTER TABLE {table} ALTER COLUMN {column} TYPE jsonb USING {column}::jsonb;
+        END IF;
+    END $$
+    """
+
+
+def _add_foreign_key(table: str, column: str, ref_table: str) -> str:
+    """DDL adding an ON DELETE CASCADE foreign key, skipped if it already exists"""
+    name = f"{table}_{column}_fkey"
+    # NOT VALID: enforced for new rows without failing on pre-existing orphans
+    return f"""
+    DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = '{name}') THEN
+            ALTER TABLE {table} ADD CONSTRAINT {name} FOREIGN KEY ({column})
+                REFERENCES {ref_table} (id) ON DELETE CASCADE NOT VALID;
+        END IF;
+    END $$
+    """
+
+
+# Idempotent DDL for columns added after a table was first created
+# (create_all only creates missing tables, it never alters existing ones)
+SCHEMA_MIGRATIONS = [
+    "ALTER TABLE datasets ADD COLUMN IF NOT EXISTS schema_json JSON",
+    _to_jsonb("datasets", "column_names"),
+    "CREATE INDEX IF NOT EXISTS ix_dataset_columns_gin ON datasets USING gin (column_names)",
+    "CREATE INDEX IF NOT EXISTS ix_analyses_dataset_date ON analyses (dataset_id, analysis_date DESC)",
+    _add_foreign_key("analyses", "dataset_id", "datasets"),
+    _add_foreign_key("visualizations", "analysis_id", "analyses"),
+    "CREATE INDEX IF NOT EXISTS ix_visualizations_analysis_id ON visualizations (analysis_id)",
+    "ALTER TABLE analyses ADD COLUMN IF NOT EXISTS cleaned_data_info_blob BYTEA",
+    "ALTER TABLE analyses ADD COLUMN IF NOT EXISTS statistics_blob BYTEA",
+    "ALTER TABLE analyses ADD COLUMN IF NOT EXISTS anomalies_blob BYTEA",
+    "ALTER TABLE datasets ADD COLUMN IF NOT EXISTS schema_text TEXT",
+    "ALTER TABLE datasets ADD COLUMN IF NOT EXISTS column_list TEXT",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_visualizations_analysis_file ON visualizations (analysis_id, file_path)",
+]
+
+# Analysis JSON columns that moved to zstd-compressed <name>_blob columns
+COMPRESSED_JSON_COLUMNS = ["cleaned_data_info", "statistics", "anomalies"]
+
+
+def _backfill_compressed_json(conn):
+    """Compress values left in the old JSON columns into their _blob columns, then drop them"""
+    existing = {col["name"] for col in inspect(conn).get_columns("analyses")}
+    for column in COMPRESSED_JSON_COLUMNS:
+        if column not in existing:
+            continue
+        rows = conn.execute(text(
+            f"SELECT id, {column}::text FROM analyses WHERE {column} IS NOT NULL AND {column}_blob IS NULL"
+        )).fetchall()
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        if rows:
+            conn.execute(
+                text(f"UPDATE analyses SET {column}_blob = :blob WHERE id = :id"),
+                [{"id": row_id, "blob": compressor.compress(value.encode("utf-8"))} for row_id, value in rows]
+            )
+        conn.execute(text(f"ALTER TABLE analyses DROP COLUMN {column}"))
+
+
 def init_db():
     """Initialize database tables"""
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for statement in SCHEMA_MIGRATIONS:
+            conn.execute(text(statement))
+        _backfill_compressed_json(conn)
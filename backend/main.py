@@ -2,22 +2,43 @@ from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import JSONResponse, FileResponse
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.dialects.postgresql import insert
 from pydantic import BaseModel
 import os
-import shutil
-from datetime import datetime
-from typing import Optional
+import asyncio
+import logging
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+import aiofiles
+from datetime import datetime, timedelta
+from typing import List, Optional
 from dotenv import load_dotenv
 
-from database import get_db, init_db
+from database import SessionLocal, get_db, init_db
+from logging_config import setup_logging, shutdown_logging
 from models import Dataset, Analysis, Visualization
 from agents.graph import analysis_graph
+from agents.llm import close_http_clients
+from agents.nodes import statistics_to_json
 from agents.qa_agent import answer_question
-from agents.text_to_sql_agent import generate_sql_query
+from agents.text_to_sql_agent import (
+    SQL_BATCH_MAX_QUESTIONS,
+    agenerate_sql_batch,
+    agenerate_sql_query,
+    extract_schema_from_dataset,
+    render_schema,
+    schema_from_cleaned_data,
+    schema_from_dataframe
+)
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Initialize FastAPI app
 app = FastAPI(
     title="AI Data Analyst Agent Platform",
@@ -39,6 +60,84 @@ UPLOAD_DIR = os.getenv("UPLOAD_DIR", "./uploads")
 VIZ_DIR = os.getenv("VISUALIZATIONS_DIR", "./visualizations")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(VIZ_DIR, exist_ok=True)
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MB
+
+# Analyses run as background tasks; at most this many execute at once
+ANALYSIS_CONCURRENCY = int(os.getenv("ANALYSIS_CONCURRENCY", "8"))
+_analysis_semaphore = asyncio.Semaphore(ANALYSIS_CONCURRENCY)
+# Upper bound on an analysis, queueing included. A row still "processing" this long
+# after creation (plus time to save results) has no live task in any process.
+ANALYSIS_TIMEOUT = int(os.getenv("ANALYSIS_TIMEOUT", "3600"))  # seconds
+ANALYSIS_STALE_AFTER = timedelta(seconds=ANALYSIS_TIMEOUT + 300)
+_analysis_tasks = set()  # Strong references so running tasks aren't garbage collected
+
+# Per-process cache of /api/text-to-sql responses. Datasets are immutable once
+# uploaded (a re-upload gets a new id), so entries only need to expire, not be invalidated.
+TEXT_TO_SQL_CACHE_TTL = int(os.getenv("TEXT_TO_SQL_CACHE_TTL", "1800"))  # seconds
+TEXT_TO_SQL_CACHE_SIZE = 1024
+_text_to_sql_cache = OrderedDict()  # key -> (expires, response)
+
+
+@dataclass(frozen=True)
+class DatasetMeta:
+    """Read-only dataset fields needed by the analysis and query endpoints"""
+    id: int
+    file_path: str
+    original_filename: str
+    schema_json: Optional[dict]
+    schema_text: Optional[str]
+    column_list: Optional[str]
+
+
+@lru_cache(maxsize=1024)
+def _load_dataset_meta(dataset_id: int) -> DatasetMeta:
+    db = SessionLocal()
+    try:
+        dataset = db.get(Dataset, dataset_id)
+        if dataset is None:
+            # Raised rather than returned, so a miss is never cached
+            raise KeyError(dataset_id)
+        return DatasetMeta(
+            id=dataset.id,
+            file_path=dataset.file_path,
+            original_filename=dataset.original_filename,
+            schema_json=dataset.schema_json,
+            schema_text=dataset.schema_text,
+            column_list=dataset.column_list
+        )
+    finally:
+        db.close()
+
+
+def _get_dataset_meta(dataset_id: int) -> Optional[DatasetMeta]:
+    """Dataset metadata, cached per process (dataset rows aren't modified after upload)"""
+    try:
+        return _load_dataset_meta(dataset_id)
+    except KeyError:
+        return None
+
+
+def _text_to_sql_cache_key(dataset_id: int, question: str) -> str:
+    return hashlib.sha256(f"{dataset_id}|{question}".encode("utf-8")).hexdigest()
+
+
+def _text_to_sql_cache_get(key: str) -> Optional[dict]:
+    entry = _text_to_sql_cache.get(key)
+    if entry is None:
+        return None
+    expires, response = entry
+    if expires < time.monotonic():
+        del _text_to_sql_cache[key]
+        return None
+    _text_to_sql_cache.move_to_end(key)
+    return response
+
+
+def _text_to_sql_cache_put(key: str, response: dict):
+    _text_to_sql_cache[key] = (time.monotonic() + TEXT_TO_SQL_CACHE_TTL, response)
+    _text_to_sql_cache.move_to_end(key)
+    if len(_text_to_sql_cache) > TEXT_TO_SQL_CACHE_SIZE:
+        _text_to_sql_cache.popitem(last=False)
 
 # Mount static files for visualizations
 app.mount("/visualizations", StaticFiles(directory=VIZ_DIR), name="visualizations")
@@ -46,7 +145,41 @@ app.mount("/visualizations", StaticFiles(directory=VIZ_DIR), name="visualization
 # Initialize database on startup
 @app.on_event("startup")
 def startup_event():
+    setup_logging()
     init_db()
+    _fail_interrupted_analyses()
+
+
+INTERRUPTED_MESSAGE = "Analysis was interrupted (server restart or crash)"
+
+
+def _fail_interrupted_analyses():
+    """
+    Fail analyses whose background task was lost in a restart.
+    
+    Only rows past ANALYSIS_STALE_AFTER: younger ones may still be running in
+    another worker process, or in the old process during a rolling restart.
+    """
+    db = SessionLocal()
+    try:
+        interrupted = db.query(Analysis).filter(
+            Analysis.status == "processing",
+            Analysis.analysis_date < datetime.utcnow() - ANALYSIS_STALE_AFTER
+        ).update(
+            {"status": "failed", "error_message": INTERRUPTED_MESSAGE},
+            synchronize_session=False
+        )
+        db.commit()
+        if interrupted:
+            logger.warning("Marked %d interrupted analyses as failed", interrupted)
+    finally:
+        db.close()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await close_http_clients()
+    shutdown_logging()
 
 
 # Pydantic models for requests/responses
@@ -60,6 +193,11 @@ class TextToSQLRequest(BaseModel):
     question: str
 
 
+class TextToSQLBatchRequest(BaseModel):
+    dataset_id: int
+    questions: List[str]
+
+
 class AnalysisResponse(BaseModel):
     analysis_id: int
     status: str
@@ -91,39 +229,62 @@ async def upload_file(file: UploadFile = File(...), db: Session = Depends(get_db
         unique_filename = f"{timestamp}_{file.filename}"
         file_path = os.path.join(UPLOAD_DIR, unique_filename)
         
-        # Save file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Stream the upload to disk in chunks, counting line breaks on the way
+        # so a CSV's row count doesn't need a second full read of the file
+        newlines = 0
+        last_byte = b"\n"
+        async with aiofiles.open(file_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                newlines += chunk.count(b"\n")
+                last_byte = chunk[-1:]
+                await buffer.write(chunk)
         
         # Get file size
         file_size = os.path.getsize(file_path)
         
-        # Load file to get basic info
-        import pandas as pd
+        # Get basic info
         if file.filename.endswith('.csv'):
-            df = pd.read_csv(file_path)
+            # Estimate: lines minus the header, a final line without a trailing newline
+            # still counts. Blank lines and quoted values spanning several lines make it
+            # too high, so analysis replaces it with the row count of the actual parse.
+            rows_count = max(newlines + (last_byte != b"\n") - 1, 0)
+            # Column names and provisional types from the first block; analysis refreshes
+            # the types from the full cleaned file
+            schema = await asyncio.to_thread(extract_schema_from_dataset, file_path)
+            if not schema:
+                raise ValueError("Could not read the CSV header")
+            column_names = list(schema.keys())
         else:
-            df = pd.read_excel(file_path)
+            import pandas as pd
+            df = await asyncio.to_thread(pd.read_excel, file_path, engine="calamine")
+            rows_count = len(df)
+            column_names = df.columns.tolist()
+            schema = schema_from_dataframe(df)
         
         # Create dataset record
+        rendered_schema = render_schema(schema)
         dataset = Dataset(
             filename=unique_filename,
             original_filename=file.filename,
             file_path=file_path,
             file_size=file_size,
-            rows_count=len(df),
-            columns_count=len(df.columns),
-            column_names=df.columns.tolist()
+            rows_count=rows_count,
+            columns_count=len(column_names),
+            column_names=column_names,
+            schema_json=schema,
+            schema_text=rendered_schema["schema_text"],
+            column_list=rendered_schema["column_list"]
         )
         db.add(dataset)
         db.commit()
         db.refresh(dataset)
+        _load_dataset_meta.cache_clear()
         
         return {
             "dataset_id": dataset.id,
             "filename": file.filename,
-            "rows": len(df),
-            "columns": len(df.columns),
+            "rows": rows_count,
+            "columns": len(column_names),
             "message": "File uploaded successfully"
         }
     
@@ -131,14 +292,109 @@ async def upload_file(file: UploadFile = File(...), db: Session = Depends(get_db
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
 
+async def _execute_graph(initial_state: dict) -> dict:
+    async with _analysis_semaphore:
+        # Execute the graph (async so LLM calls don't block the event loop)
+        return await analysis_graph.ainvoke(initial_state)
+
+
+async def _run_analysis(analysis_id: int, initial_state: dict):
+    """Run the LangGraph workflow for an analysis and store its results"""
+    # No DB session while the graph runs, so no pooled connection sits idle for minutes
+    result, error = None, None
+    try:
+        result = await asyncio.wait_for(_execute_graph(initial_state), ANALYSIS_TIMEOUT)
+        if result.get("errors"):
+            error = "; ".join(result["errors"])
+    except asyncio.TimeoutError:
+        logger.error("Analysis %s timed out", analysis_id)
+        error = f"Analysis timed out after {ANALYSIS_TIMEOUT} seconds"
+    except Exception as e:
+        logger.exception("Analysis %s failed", analysis_id)
+        error = str(e)
+    
+    db = SessionLocal()
+    try:
+        analysis = db.get(Analysis, analysis_id)
+        if analysis is None:
+            logger.warning("Analysis %s no longer exists; discarding its results", analysis_id)
+            return
+        
+        try:
+            if error is not None:
+                analysis.status = "failed"
+                analysis.error_message = error
+            else:
+                _save_analysis_results(db, analysis, result)
+            db.commit()
+            if error is None:
+                # Cached metadata and SQL were built from the provisional schema
+                _load_dataset_meta.cache_clear()
+                _text_to_sql_cache.clear()
+        except Exception as e:
+            logger.exception("Saving results of analysis %s failed", analysis_id)
+            db.rollback()
+            analysis.status = "failed"
+            analysis.error_message = f"Saving results failed: {str(e)}"
+            db.commit()
+    finally:
+        db.close()
+
+
+def _save_analysis_results(db: Session, analysis: Analysis, result: dict):
+    """Stage a finished workflow's results on the analysis (committed by the caller)"""
+    analysis.cleaned_data_info = result.get("cleaning_report")
+    analysis.statistics = statistics_to_json(result.get("statistics"))
+    analysis.anomalies = result.get("anomalies")
+    analysis.insights = result.get("insights")
+    analysis.sql_queries = result.get("sql_queries")
+    
+    # Exact row count from the parsed file, replacing the upload-time estimate
+    raw_shape = result.get("raw_shape")
+    if raw_shape:
+        dataset = db.get(Dataset, analysis.dataset_id)
+        if dataset is not None:
+            dataset.rows_count = int(raw_shape[0])
+    
+    # Replace the provisional upload schema (first block only) with types from the full cleaned file
+    cleaned_data = result.get("cleaned_data")
+    if cleaned_data and os.path.exists(cleaned_data):
+        dataset = db.get(Dataset, analysis.dataset_id)
+        if dataset is not None:
+            cleaned_schema = schema_from_cleaned_data(cleaned_data)
+            schema = {
+                name: cleaned_schema.get(name, pg_type)
+                for name, pg_type in (dataset.schema_json or cleaned_schema).items()
+            }
+            rendered_schema = render_schema(schema)
+            dataset.schema_json = schema
+            dataset.schema_text = rendered_schema["schema_text"]
+            dataset.column_list = rendered_schema["column_list"]
+    
+    # Save visualizations in one multi-row INSERT; a retried save skips rows already stored
+    visualizations = [
+        {
+            "analysis_id": analysis.id,
+            "visualization_type": viz.get("type"),
+            "file_path": viz.get("filename")
+        }
+        for viz in result.get("visualizations", [])
+    ]
+    if visualizations:
+        db.execute(insert(Visualization).on_conflict_do_nothing(), visualizations)
+    
+    # Marked completed in the same commit, so pollers never see partial results
+    analysis.status = "completed"
+
+
 @app.post("/api/analyze/{dataset_id}", response_model=AnalysisResponse)
 async def analyze_dataset(dataset_id: int, db: Session = Depends(get_db)):
     """
-    Run AI analysis on uploaded dataset
+    Start AI analysis on uploaded dataset; poll /api/analysis/{analysis_id} for results
     """
     try:
         # Get dataset
-        dataset = db.query(Dataset).filter(Dataset.id == dataset_id).first()
+        dataset = _get_dataset_meta(dataset_id)
         if not dataset:
             raise HTTPException(status_code=404, detail="Dataset not found")
         
@@ -151,7 +407,7 @@ async def analyze_dataset(dataset_id: int, db: Session = Depends(get_db)):
         db.commit()
         db.refresh(analysis)
         
-        # Run LangGraph workflow
+        # Run LangGraph workflow in the background
         initial_state = {
             "dataset_id": dataset_id,
             "file_path": dataset.file_path,
@@ -160,50 +416,19 @@ async def analyze_dataset(dataset_id: int, db: Session = Depends(get_db)):
             "errors": [],
             "status": "processing"
         }
-        
-        # Execute the graph
-        result = analysis_graph.invoke(initial_state)
-        
-        # Check for errors
-        if result.get("errors"):
-            analysis.status = "failed"
-            analysis.error_message = "; ".join(result["errors"])
-            db.commit()
-            raise HTTPException(status_code=500, detail=f"Analysis failed: {analysis.error_message}")
-        
-        # Save results to database
-        analysis.cleaned_data_info = result.get("cleaning_report")
-        analysis.statistics = result.get("statistics")
-        analysis.anomalies = result.get("anomalies")
-        analysis.insights = result.get("insights")
-        analysis.sql_queries = result.get("sql_queries")
-        analysis.status = "completed"
-        db.commit()
-        
-        # Save visualizations
-        for viz in result.get("visualizations", []):
-            visualization = Visualization(
-                analysis_id=analysis.id,
-                visualization_type=viz.get("type"),
-                file_path=viz.get("filename")
-            )
-            db.add(visualization)
-        db.commit()
+        task = asyncio.create_task(_run_analysis(analysis.id, initial_state))
+        _analysis_tasks.add(task)
+        task.add_done_callback(_analysis_tasks.discard)
         
         return AnalysisResponse(
             analysis_id=analysis.id,
-            status="completed",
-            message="Analysis completed successfully"
+            status="processing",
+            message="Analysis started"
         )
     
     except HTTPException:
         raise
     except Exception as e:
-        # Update analysis status
-        if 'analysis' in locals():
-            analysis.status = "failed"
-            analysis.error_message = str(e)
-            db.commit()
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
 
@@ -212,14 +437,18 @@ async def get_analysis(analysis_id: int, db: Session = Depends(get_db)):
     """
     Get analysis results
     """
-    analysis = db.query(Analysis).filter(Analysis.id == analysis_id).first()
+    # Visualizations come with the analysis (selectin-loaded relationship)
+    analysis = db.query(Analysis).options(
+        selectinload(Analysis.visualizations)
+    ).filter(Analysis.id == analysis_id).first()
     if not analysis:
         raise HTTPException(status_code=404, detail="Analysis not found")
     
-    # Get visualizations
-    visualizations = db.query(Visualization).filter(
-        Visualization.analysis_id == analysis_id
-    ).all()
+    # Lost its task (e.g. a crashed worker): report failure so pollers stop
+    if analysis.status == "processing" and analysis.analysis_date < datetime.utcnow() - ANALYSIS_STALE_AFTER:
+        analysis.status = "failed"
+        analysis.error_message = INTERRUPTED_MESSAGE
+        db.commit()
     
     return {
         "id": analysis.id,
@@ -237,7 +466,7 @@ async def get_analysis(analysis_id: int, db: Session = Depends(get_db)):
                 "type": viz.visualization_type,
                 "url": f"/visualizations/{viz.file_path}"
             }
-            for viz in visualizations
+            for viz in analysis.visualizations
         ],
         "error_message": analysis.error_message
     }
@@ -250,7 +479,7 @@ async def ask_question(request: QuestionRequest, db: Session = Depends(get_db)):
     """
     try:
         # Get dataset
-        dataset = db.query(Dataset).filter(Dataset.id == request.dataset_id).first()
+        dataset = _get_dataset_meta(request.dataset_id)
         if not dataset:
             raise HTTPException(status_code=404, detail="Dataset not found")
         
@@ -263,7 +492,7 @@ async def ask_question(request: QuestionRequest, db: Session = Depends(get_db)):
         statistics = analysis.statistics if analysis else None
         
         # Get answer from Q&A agent
-        answer = answer_question(
+        answer = await answer_question(
             file_path=dataset.file_path,
             question=request.question,
             statistics=statistics
@@ -281,24 +510,33 @@ async def ask_question(request: QuestionRequest, db: Session = Depends(get_db)):
 
 
 @app.post("/api/text-to-sql")
-async def text_to_sql(request: TextToSQLRequest, db: Session = Depends(get_db)):
+async def text_to_sql(request: TextToSQLRequest):
     """
     Convert natural language question to SQL query
     """
+    # Repeated question: skip the DB lookup and generation entirely
+    cache_key = _text_to_sql_cache_key(request.dataset_id, request.question)
+    cached = _text_to_sql_cache_get(cache_key)
+    if cached is not None:
+        return cached
+    
     try:
         # Get dataset
-        dataset = db.query(Dataset).filter(Dataset.id == request.dataset_id).first()
+        dataset = _get_dataset_meta(request.dataset_id)
         if not dataset:
             raise HTTPException(status_code=404, detail="Dataset not found")
         
         # Generate SQL query
-        result = generate_sql_query(
+        result = await agenerate_sql_query(
             question=request.question,
             dataset_id=dataset.id,
-            file_path=dataset.file_path
+            file_path=dataset.file_path,
+            schema=dataset.schema_json,
+            schema_text=dataset.schema_text,
+            column_list=dataset.column_list
         )
         
-        return {
+        response = {
             "question": request.question,
             "sql_query": result.get("sql_query"),
             "needs_clarification": result.get("needs_clarification", False),
@@ -306,6 +544,57 @@ async def text_to_sql(request: TextToSQLRequest, db: Session = Depends(get_db)):
             "table_name": result.get("table_name"),
             "schema": result.get("schema")
         }
+        # Only successful generations; errors (e.g. API outages) should be retried
+        if response["sql_query"] is not None:
+            _text_to_sql_cache_put(cache_key, response)
+        return response
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"SQL generation failed: {str(e)}")
+
+
+@app.post("/api/text-to-sql/batch")
+async def text_to_sql_batch(request: TextToSQLBatchRequest):
+    """
+    Convert several natural language questions to SQL queries in one LLM call
+    """
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="No questions provided")
+    if len(request.questions) > SQL_BATCH_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {SQL_BATCH_MAX_QUESTIONS} questions per batch"
+        )
+    
+    try:
+        # Get dataset
+        dataset = _get_dataset_meta(request.dataset_id)
+        if not dataset:
+            raise HTTPException(status_code=404, detail="Dataset not found")
+        
+        # Generate SQL queries
+        results = await agenerate_sql_batch(
+            questions=request.questions,
+            dataset_id=dataset.id,
+            file_path=dataset.file_path,
+            schema=dataset.schema_json,
+            schema_text=dataset.schema_text,
+            column_list=dataset.column_list
+        )
+        
+        return [
+            {
+                "question": question,
+                "sql_query": result.get("sql_query"),
+                "needs_clarification": result.get("needs_clarification", False),
+                "clarification_message": result.get("clarification_message"),
+                "table_name": result.get("table_name"),
+                "schema": result.get("schema")
+            }
+            for question, result in zip(request.questions, results)
+        ]
     
     except HTTPException:
         raise
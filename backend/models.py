@@ -1,6 +1,8 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, Index, ForeignKey, UniqueConstraint
+from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.postgresql import JSONB
 from datetime import datetime
-from database import Base
+from database import Base, ZstdJSON
 
 
 class Dataset(Base):
@@ -15,7 +17,17 @@ class Dataset(Base):
     upload_date = Column(DateTime, default=datetime.utcnow)
     rows_count = Column(Integer)
     columns_count = Column(Integer)
-    column_names = Column(JSON)
+    column_names = Column(JSONB)
+    # JSON, not JSONB: JSONB reorders object keys and prompts rely on file column order
+    schema_json = Column(JSON)  # column name -> PostgreSQL type, extracted at upload
+    # Schema pre-rendered for the text-to-SQL prompt (see render_schema)
+    schema_text = Column(Text)
+    column_list = Column(Text)
+
+    __table_args__ = (
+        # Containment lookups, e.g. column_names @> '["price"]'
+        Index("ix_dataset_columns_gin", column_names, postgresql_using="gin"),
+    )
 
 
 class Analysis(Base):
@@ -23,13 +35,15 @@ class Analysis(Base):
     __tablename__ = "analyses"
 
     id = Column(Integer, primary_key=True, index=True)
-    dataset_id = Column(Integer, nullable=False)
+    # Indexed by ix_analyses_dataset_date (dataset_id is its leading column)
+    dataset_id = Column(Integer, ForeignKey("datasets.id", ondelete="CASCADE"), nullable=False)
     analysis_date = Column(DateTime, default=datetime.utcnow)
     
     # Analysis results
-    cleaned_data_info = Column(JSON)
-    statistics = Column(JSON)
-    anomalies = Column(JSON)
+    # Large nested JSON, stored zstd-compressed (BYTEA <name>_blob columns)
+    cleaned_data_info = Column("cleaned_data_info_blob", ZstdJSON)
+    statistics = Column("statistics_blob", ZstdJSON)
+    anomalies = Column("anomalies_blob", ZstdJSON)
     insights = Column(Text)
     sql_queries = Column(Text)
     
@@ -37,13 +51,32 @@ class Analysis(Base):
     status = Column(String, default="pending")  # pending, processing, completed, failed
     error_message = Column(Text, nullable=True)
 
+    # Loaded with one batched SELECT ... WHERE analysis_id IN (...) alongside the analysis
+    visualizations = relationship(
+        "Visualization",
+        back_populates="analysis",
+        lazy="selectin",
+        passive_deletes=True
+    )
+
+    __table_args__ = (
+        # Latest analysis for a dataset (/api/question)
+        Index("ix_analyses_dataset_date", dataset_id, analysis_date.desc()),
+    )
+
 
 class Visualization(Base):
     """Model for storing visualization metadata"""
     __tablename__ = "visualizations"
 
     id = Column(Integer, primary_key=True, index=True)
-    analysis_id = Column(Integer, nullable=False)
+    analysis_id = Column(Integer, ForeignKey("analyses.id", ondelete="CASCADE"), index=True, nullable=False)
     visualization_type = Column(String, nullable=False)  # histogram, scatter, correlation, etc.
     file_path = Column(String, nullable=False)
     created_date = Column(DateTime, default=datetime.utcnow)
+
+    analysis = relationship("Analysis", back_populates="visualizations")
+
+    __table_args__ = (
+        UniqueConstraint("analysis_id", "file_path", name="uq_visualizations_analysis_file"),
+    )
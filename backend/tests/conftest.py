@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Tests import the backend modules the same way main.py does (from backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The agent modules build their LLM clients at import time
+os.environ.setdefault("DEEPSEEK_API_KEY", "test-key")
+os.environ.setdefault("DEEPSEEK_BASE_URL", "http://localhost")
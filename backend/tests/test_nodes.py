@@ -0,0 +1,36 @@
+from datetime import date, datetime
+
+import pandas as pd
+
+from agents.nodes import _sql_literal, read_dataset
+
+
+def _write_dated_csv(tmp_path):
+    path = tmp_path / "dated.csv"
+    path.write_text(
+        "name,day,seen_at,count\n"
+        "A,2023-01-05,2023-01-05 10:00:00,5\n"
+        "B,2023-01-06,2023-01-06 11:30:00,6\n"
+        "C,,2023-01-07 12:00:00,7\n"
+    )
+    return str(path)
+
+
+def test_read_dataset_keeps_date_columns_as_text(tmp_path):
+    df = read_dataset(_write_dated_csv(tmp_path))
+
+    # Same typing as pd.read_csv: dates/timestamps stay strings, numbers stay numeric
+    expected = pd.read_csv(_write_dated_csv(tmp_path))
+    assert df["day"].tolist()[:2] == ["2023-01-05", "2023-01-06"]
+    assert pd.isna(df["day"].iloc[2])
+    assert df["seen_at"].tolist() == expected["seen_at"].tolist()
+    assert pd.api.types.is_integer_dtype(df["count"])
+
+
+def test_sql_literal_quotes_dates_and_timestamps():
+    assert _sql_literal(date(2023, 1, 5)) == "'2023-01-05'"
+    assert _sql_literal(datetime(2023, 1, 5, 10, 0)) == "'2023-01-05 10:00:00'"
+    assert _sql_literal(pd.Timestamp("2023-01-05 10:00:00")) == "'2023-01-05 10:00:00'"
+    assert _sql_literal(pd.NaT) == "NULL"
+    assert _sql_literal("O'Brien") == "'O''Brien'"
+    assert _sql_literal(5) == "5"
@@ -30,24 +30,34 @@ const AnalysisDashboard: React.FC<AnalysisDashboardProps> = ({ analysisId }) =>
     const [selectedVizIndex, setSelectedVizIndex] = useState(0)
 
     useEffect(() => {
-        fetchAnalysis()
-        const interval = setInterval(() => {
-            if (analysis?.status === 'processing') {
-                fetchAnalysis()
+        let timer: ReturnType<typeof setTimeout> | undefined
+        let cancelled = false
+
+        // Analysis runs in the background; keep polling until it finishes
+        const poll = async () => {
+            const data = await fetchAnalysis()
+            if (!cancelled && data?.status === 'processing') {
+                timer = setTimeout(poll, 3000)
             }
-        }, 3000)
+        }
+        poll()
 
-        return () => clearInterval(interval)
+        return () => {
+            cancelled = true
+            clearTimeout(timer)
+        }
     }, [analysisId])
 
-    const fetchAnalysis = async () => {
+    const fetchAnalysis = async (): Promise<AnalysisData | null> => {
         try {
             const response = await axios.get(`/api/analysis/${analysisId}`)
             setAnalysis(response.data)
             setLoading(false)
+            return response.data
         } catch (err: any) {
             setError(err.response?.data?.detail || 'Failed to load analysis')
             setLoading(false)
+            return null
         }
     }
 